@@ -1,17 +1,31 @@
 from flask import Flask, request, jsonify
-from flask_sqlalchemy import SQLAlchemy
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
-from werkzeug.security import generate_password_hash, check_password_hash
 import os
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from common.db import create_db
+from common.metrics import init_metrics
+from common.serving import run, worker_processes
+from common.tracing import init_tracing
+from hashing import HasherBusy, PasswordHasher
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'supersecretkey123')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('SQLALCHEMY_DATABASE_URI', 'sqlite:///auth.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['JWT_SECRET_KEY'] = os.environ.get('SECRET_KEY', 'supersecretkey123')
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+app.config['HASH_WORKERS'] = int(os.environ.get('HASH_WORKERS', '0')) or None
+app.config['HASH_MAX_PENDING'] = int(os.environ.get('HASH_MAX_PENDING', '0')) or None
 
-db = SQLAlchemy(app)
+db = create_db(app)
+init_metrics(app, db)
+init_tracing(app, db, 'auth-service')
 jwt = JWTManager(app)
+hasher = PasswordHasher(method=app.config['PASSWORD_HASH_METHOD'],
+                        workers=app.config['HASH_WORKERS'],
+                        max_pending=app.config['HASH_MAX_PENDING'],
+                        processes=worker_processes())
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -22,9 +36,12 @@ class User(db.Model):
 with app.app_context():
     db.create_all()
 
+def overloaded():
+    return jsonify({'error': 'Service busy, please retry'}), 503, {'Retry-After': '1'}
+
 @app.route('/health', methods=['GET'])
 def health_check():
-    return jsonify({'status': 'healthy', 'service': 'auth-service'})
+    return jsonify({'status': 'healthy', 'service': 'auth-service', 'password_hashing': hasher.stats()})
 
 @app.route('/register', methods=['POST'])
 def register():
@@ -39,7 +56,7 @@ def register():
         if User.query.filter_by(email=email).first():
             return jsonify({'error': 'User already exists'}), 400
         
-        password_hash = generate_password_hash(password)
+        password_hash = hasher.hash(password)
         user = User(email=email, password_hash=password_hash)
         
         db.session.add(user)
@@ -53,6 +70,8 @@ def register():
             'user_id': user.id
         }), 201
         
+    except (HasherBusy, FutureTimeoutError):
+        return overloaded()
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -68,7 +87,15 @@ def login():
         
         user = User.query.filter_by(email=email).first()
         
-        if user and check_password_hash(user.password_hash, password):
+        if user and hasher.verify(user.password_hash, password):
+            # Upgrade hashes made with older parameters while we have the plaintext
+            if hasher.needs_rehash(user.password_hash):
+                try:
+                    user.password_hash = hasher.hash(password)
+                    db.session.commit()
+                except (HasherBusy, FutureTimeoutError):
+                    db.session.rollback()
+            
             access_token = create_access_token(identity=str(user.id))
             return jsonify({
                 'message': 'Login successful',
@@ -78,6 +105,8 @@ def login():
         
         return jsonify({'error': 'Invalid credentials'}), 401
         
+    except (HasherBusy, FutureTimeoutError):
+        return overloaded()
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -88,4 +117,4 @@ def verify_token():
     return jsonify({'valid': True, 'user_id': current_user_id}), 200
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
+    run(app, 5001, db=db)
\ No newline at end of file
@@ -0,0 +1,131 @@
+"""Password hashing on a bounded process pool.
+
+Werkzeug's KDFs are deliberately slow and hold the GIL, so running them in
+the request thread stalls every other request in the worker (including
+``/verify``). ``PasswordHasher`` runs them in separate processes and sheds
+load with ``HasherBusy`` once ``max_pending`` jobs are queued or running.
+A job keeps its slot until it finishes, even if the caller gave up waiting.
+
+Every gunicorn worker has its own pool, so the defaults split the CPUs
+between the ``processes`` serving the app: ``workers`` is
+``CPUs // processes`` (at least 1) and ``max_pending`` is ``workers * 4``.
+Latency, rejections, jobs in flight and slots are exported on ``/metrics``
+(``password_hash_*``); saturation is in-flight over slots.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from prometheus_client import Counter, Gauge, Histogram
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from common.metrics import LATENCY_BUCKETS
+
+HASH_LATENCY = Histogram(
+    'password_hash_duration_seconds', 'Password hashing latency, queueing included',
+    ['operation'], buckets=LATENCY_BUCKETS)
+HASH_REJECTED = Counter(
+    'password_hash_rejected_total', 'Hashing jobs shed because the pool was saturated',
+    ['operation'])
+HASH_IN_FLIGHT = Gauge(
+    'password_hash_in_flight', 'Hashing jobs queued or running',
+    multiprocess_mode='livesum')
+HASH_SLOTS = Gauge(
+    'password_hash_slots', 'Hashing jobs accepted before shedding (max_pending)',
+    multiprocess_mode='livesum')
+
+
+class HasherBusy(Exception):
+    """Raised when the hashing pool is saturated."""
+
+
+def hash_method_of(pwhash):
+    return pwhash.split('$', 1)[0]
+
+
+class PasswordHasher:
+    def __init__(self, method='pbkdf2:sha256:600000', workers=None, max_pending=None,
+                 timeout=10.0, processes=1):
+        self.method = method
+        # What stored hashes made with ``method`` start with, defaults filled in
+        # (e.g. ``pbkdf2:sha256`` is stored as ``pbkdf2:sha256:600000``)
+        self.stored_method = hash_method_of(generate_password_hash('', method))
+        self.workers = workers or max(1, multiprocessing.cpu_count() // processes)
+        self.max_pending = max_pending or self.workers * 4
+        self.timeout = timeout
+
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def _get_executor(self):
+        # Created lazily per process so forked server workers get their own pool
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                self._pid = os.getpid()
+                # Set per serving process; the preloading master never hashes
+                HASH_SLOTS.set(self.max_pending)
+            return self._executor
+
+    def _run(self, operation, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            HASH_REJECTED.labels(operation).inc()
+            raise HasherBusy('password hashing pool is saturated')
+
+        start = time.monotonic()
+        with self._lock:
+            self.in_flight += 1
+        HASH_IN_FLIGHT.inc()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._finish(operation, start)
+            raise
+        # Free the slot when the job is done, not when result() times out
+        future.add_done_callback(lambda _: self._finish(operation, start))
+        return future.result(timeout=self.timeout)
+
+    def _finish(self, operation, start):
+        elapsed = time.monotonic() - start
+        HASH_IN_FLIGHT.dec()
+        HASH_LATENCY.labels(operation).observe(elapsed)
+        with self._lock:
+            self.in_flight -= 1
+            self.completed += 1
+            self.total_seconds += elapsed
+            self.max_seconds = max(self.max_seconds, elapsed)
+        self._slots.release()
+
+    def hash(self, password):
+        return self._run('hash', generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        return self._run('verify', check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        return hash_method_of(pwhash) != self.stored_method
+
+    def stats(self):
+        completed = self.completed or 1
+        return {
+            'workers': self.workers,
+            'max_pending': self.max_pending,
+            'in_flight': self.in_flight,
+            'saturation': round(self.in_flight / self.max_pending, 2),
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'avg_ms': round(self.total_seconds / completed * 1000, 2),
+            'max_ms': round(self.max_seconds * 1000, 2),
+        }
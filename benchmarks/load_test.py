@@ -0,0 +1,222 @@
+"""End-to-end load test across all six services.
+
+    python benchmarks/load_test.py --users 8 --iterations 5 --products 5000 \\
+        --cart-size 3 --output results.json
+
+Boots every service in-process (see ``stack.py``), seeds the catalog, then
+runs ``--users`` concurrent virtual users. Each registers and logs in, then
+repeats a checkout journey ``--iterations`` times: browse ``/products``, add
+``--cart-size`` items to the cart, view the cart, place an order and pay.
+
+Prints throughput and p50/p95/p99 per endpoint and writes the same numbers
+as JSON (keys sorted, one run per file) so two runs can be diffed.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from stack import Stack  # noqa: E402
+
+CATEGORIES = ['Electronics', 'Clothing', 'Home', 'Sports', 'Kitchen', 'Office']
+
+BENCHMARK_ENV = {
+    'TRACE_EXPORTER': 'none',
+    # Keep the per-user password hashes from dominating the run
+    'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+}
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+
+    def record(self, endpoint, status, seconds):
+        with self._lock:
+            self.samples[endpoint].append(seconds * 1000)
+            self.statuses[endpoint][str(status)] += 1
+
+    def summary(self, elapsed):
+        endpoints = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            statuses = self.statuses[endpoint]
+            errors = sum(count for status, count in statuses.items()
+                         if status == 'error' or status.startswith('5'))
+            endpoints[endpoint] = {
+                'requests': len(samples),
+                'errors': errors,
+                'statuses': dict(sorted(statuses.items())),
+                'throughput_rps': round(len(samples) / elapsed, 2),
+                'mean_ms': round(sum(samples) / len(samples), 2),
+                'p50_ms': round(percentile(samples, 50), 2),
+                'p95_ms': round(percentile(samples, 95), 2),
+                'p99_ms': round(percentile(samples, 99), 2),
+                'max_ms': round(max(samples), 2),
+            }
+        total = sum(len(samples) for samples in self.samples.values())
+        return {
+            'elapsed_s': round(elapsed, 3),
+            'requests': total,
+            'errors': sum(endpoint['errors'] for endpoint in endpoints.values()),
+            'throughput_rps': round(total / elapsed, 2),
+            'endpoints': endpoints,
+        }
+
+
+class VirtualUser:
+    def __init__(self, stack, recorder, args, index, rng):
+        self.stack = stack
+        self.recorder = recorder
+        self.args = args
+        self.index = index
+        self.rng = rng
+        self.session = requests.Session()
+        self.headers = {}
+
+    def call(self, endpoint, service, method, path, **kwargs):
+        """Time one request; ``endpoint`` is the label it is reported under."""
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, self.stack.url(service) + path,
+                                            headers=self.headers, timeout=30, **kwargs)
+        except requests.RequestException:
+            self.recorder.record(endpoint, 'error', time.perf_counter() - start)
+            return None
+        self.recorder.record(endpoint, response.status_code, time.perf_counter() - start)
+        return response
+
+    def call_with_retry(self, *args, attempts=5, **kwargs):
+        # auth-service sheds load with 503 + Retry-After when its hashing pool is full
+        for _ in range(attempts):
+            response = self.call(*args, **kwargs)
+            if response is None or response.status_code != 503:
+                return response
+            time.sleep(float(response.headers.get('Retry-After', 1)) * self.rng.random())
+        return response
+
+    def sign_in(self):
+        credentials = {'email': f'load-{self.index}@example.com', 'password': 'load-test-password'}
+        self.call_with_retry('POST /register', 'auth-service:5001', 'POST', '/register', json=credentials)
+        response = self.call_with_retry('POST /login', 'auth-service:5001', 'POST', '/login', json=credentials)
+        if response is None or response.status_code != 200:
+            return False
+        self.headers = {'Authorization': f"Bearer {response.json()['access_token']}"}
+        return True
+
+    def checkout(self):
+        page_size = 20
+        last_page = max(1, self.args.products // page_size)
+        for _ in range(self.args.browse_pages):
+            self.call('GET /products', 'product-service:5003', 'GET', '/products',
+                      params={'page': self.rng.randint(1, last_page), 'per_page': page_size})
+
+        product_ids = self.rng.sample(range(1, self.args.products + 1), self.args.cart_size)
+        for product_id in product_ids:
+            self.call('POST /cart', 'cart-service:5004', 'POST', '/cart',
+                      json={'product_id': product_id, 'quantity': 1})
+
+        self.call('GET /cart', 'cart-service:5004', 'GET', '/cart')
+
+        response = self.call('POST /orders', 'order-service:5005', 'POST', '/orders')
+        # Orders do not empty the cart; without this every iteration would
+        # order the lines of all the earlier ones too
+        self.call('POST /cart/batch', 'cart-service:5004', 'POST', '/cart/batch',
+                  json={'operations': [{'op': 'remove', 'product_id': product_id}
+                                       for product_id in product_ids]})
+        if response is None or response.status_code != 201:
+            return
+        order = response.json()
+        self.call('POST /payments', 'payment-service:5006', 'POST', '/payments',
+                  json={'order_id': order['order_id'], 'amount': order['total_amount']})
+
+    def run(self):
+        if not self.sign_in():
+            return
+        for _ in range(self.args.iterations):
+            self.checkout()
+
+
+def seed_catalog(stack, count, rng):
+    product = stack.modules['product-service:5003']
+    rows = [{
+        'name': f'Load test product {i}',
+        'description': f'Seeded product number {i} for the load test',
+        'price': round(rng.uniform(1, 500), 2),
+        # Plenty of stock so reservations never become the bottleneck
+        'stock_quantity': 1000000,
+        'category': rng.choice(CATEGORIES),
+    } for i in range(count)]
+    with product.app.app_context():
+        # Drop the demo rows so product ids are 1..count
+        product.db.session.query(product.Product).delete()
+        product.db.session.execute(product.db.insert(product.Product), rows)
+        product.db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=8, help='concurrent virtual users')
+    parser.add_argument('--iterations', type=int, default=5, help='checkouts per user')
+    parser.add_argument('--products', type=int, default=1000, help='catalog size')
+    parser.add_argument('--cart-size', type=int, default=3, help='distinct items added per checkout')
+    parser.add_argument('--browse-pages', type=int, default=3, help='GET /products calls per checkout')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write results as JSON to this path')
+    args = parser.parse_args()
+    if args.cart_size > args.products:
+        parser.error('--cart-size cannot exceed --products')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        stack = Stack(tmp, env=BENCHMARK_ENV).start()
+        seed_catalog(stack, args.products, random.Random(args.seed))
+
+        recorder = Recorder()
+        users = [VirtualUser(stack, recorder, args, i, random.Random(args.seed + i))
+                 for i in range(args.users)]
+        threads = [threading.Thread(target=user.run) for user in users]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        stack.stop()
+
+    summary = recorder.summary(elapsed)
+    print(f"{summary['requests']} requests in {summary['elapsed_s']}s "
+          f"({summary['throughput_rps']} req/s, {summary['errors']} errors)")
+    for endpoint, stats in summary['endpoints'].items():
+        print(f"{endpoint:16} n={stats['requests']:5} {stats['throughput_rps']:8.2f} req/s "
+              f"p50={stats['p50_ms']:7.2f}ms p95={stats['p95_ms']:7.2f}ms p99={stats['p99_ms']:7.2f}ms "
+              f"errors={stats['errors']}")
+
+    if args.output:
+        result = {
+            'config': {key: value for key, value in vars(args).items() if key != 'output'},
+            'environment': {'python': platform.python_version(), 'platform': platform.platform()},
+            'results': summary,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f'wrote {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Benchmark POST /products/import throughput on SQLite.
+
+    python benchmarks/product_import.py --rows 200000 --batch-sizes 1 100 1000 5000
+
+Generates a supplier catalog as NDJSON and CSV, then imports it through the
+Flask test client once per batch size and format, emptying the SQLite table
+and search index between runs. ``--baseline`` rows are also created one per request with
+``POST /products`` for comparison.
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CATEGORIES = ['Electronics', 'Clothing', 'Home', 'Sports', 'Kitchen', 'Office']
+FIELDS = ['name', 'description', 'price', 'stock_quantity', 'category', 'image_url']
+
+
+def load_app(db_path):
+    os.environ['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    sys.path[:0] = [ROOT, os.path.join(ROOT, 'product-service')]
+    import product
+    return product
+
+
+def make_rows(count, rng):
+    return [{
+        'name': f'Supplier item {i}',
+        'description': f'Imported catalog entry {i} with a short description',
+        'price': round(rng.uniform(1, 500), 2),
+        'stock_quantity': rng.randint(0, 1000),
+        'category': rng.choice(CATEGORIES),
+        'image_url': f'https://cdn.example.com/items/{i}.jpg',
+    } for i in range(count)]
+
+
+def to_ndjson(rows):
+    return ''.join(json.dumps(row) + '\n' for row in rows).encode()
+
+
+def to_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=FIELDS)
+    writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue().encode()
+
+
+def reset(product):
+    # Start each run from an empty, compacted table and search index
+    with product.app.app_context():
+        product.db.session.query(product.Product).delete()
+        product.db.session.query(product.CategoryFacet).delete()
+        product.db.session.execute(product.db.text("INSERT INTO product_fts(product_fts) VALUES ('rebuild')"))
+        product.db.session.commit()
+        with product.db.engine.connect() as conn:
+            conn.execution_options(isolation_level='AUTOCOMMIT').exec_driver_sql('VACUUM')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--baseline', type=int, default=2000,
+                        help='rows to create one request at a time (0 to skip)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows, random.Random(args.seed))
+    bodies = {'ndjson': (to_ndjson(rows), 'application/x-ndjson'), 'csv': (to_csv(rows), 'text/csv')}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        product = load_app(os.path.join(tmp, 'products.db'))
+        client = product.app.test_client()
+        from common.auth import INTERNAL_TOKEN_HEADER, internal_token
+        internal = {INTERNAL_TOKEN_HEADER: internal_token(product.app)}
+
+        if args.baseline:
+            reset(product)
+            start = time.perf_counter()
+            for row in rows[:args.baseline]:
+                response = client.post('/products', json=row)
+                assert response.status_code == 201, response.get_json()
+            elapsed = time.perf_counter() - start
+            print(f'{"POST /products (1 per request)":34} {args.baseline / elapsed:10.0f} rows/s')
+
+        for fmt, (body, content_type) in bodies.items():
+            for batch_size in args.batch_sizes:
+                reset(product)
+                start = time.perf_counter()
+                response = client.post('/products/import', data=body, content_type=content_type,
+                                       query_string={'batch_size': batch_size}, headers=internal)
+                elapsed = time.perf_counter() - start
+                report = response.get_json()
+                assert response.status_code == 200 and report['inserted'] == args.rows, report
+                label = f'import {fmt} batch_size={batch_size}'
+                print(f'{label:34} {args.rows / elapsed:10.0f} rows/s  ({elapsed:.2f}s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Benchmark product-service full-text search on a large SQLite catalog.
+
+    python benchmarks/product_search.py --products 100000
+
+Seeds a throwaway SQLite database, then times GET /products/search through
+the Flask test client (cache disabled) against a LIKE scan of the same data.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CATEGORIES = ['Electronics', 'Clothing', 'Home', 'Sports', 'Kitchen', 'Office']
+VOCABULARY_SIZE = 20000
+
+
+def make_vocabulary(rng):
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    return [''.join(rng.choice(letters) for _ in range(rng.randint(4, 9)))
+            for _ in range(VOCABULARY_SIZE)]
+
+
+def pick_words(rng, vocabulary, count):
+    # Zipf-like skew: a few common words, a long tail of rare ones
+    return [vocabulary[min(int(rng.paretovariate(1.1)) - 1, len(vocabulary) - 1)]
+            for _ in range(count)]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def load_app(db_path):
+    os.environ['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    os.environ['PRODUCT_CACHE_TTL'] = '0'
+    sys.path[:0] = [ROOT, os.path.join(ROOT, 'product-service')]
+    import product
+    return product
+
+
+def seed(product, count, rng, vocabulary):
+    rows = [{
+        'name': ' '.join(pick_words(rng, vocabulary, 3)).title(),
+        'description': ' '.join(pick_words(rng, vocabulary, 12)),
+        'price': round(rng.uniform(1, 500), 2),
+        'stock_quantity': rng.randint(0, 100),
+        'category': rng.choice(CATEGORIES),
+    } for _ in range(count)]
+    with product.app.app_context():
+        product.db.session.execute(product.db.insert(product.Product), rows)
+        product.db.session.commit()
+
+
+def make_queries(rng, vocabulary):
+    # Mix of very common, mid-frequency and rare terms, single and two-word
+    common, mid, rare = vocabulary[:5], vocabulary[50:500], vocabulary[2000:]
+    return ([rng.choice(common) for _ in range(3)] +
+            [rng.choice(mid) for _ in range(5)] +
+            [rng.choice(rare) for _ in range(5)] +
+            [f'{rng.choice(mid)} {rng.choice(mid)}' for _ in range(3)] +
+            [rng.choice(mid)[:3] for _ in range(2)])
+
+
+def time_calls(fn, queries, repeat):
+    samples = []
+    for _ in range(repeat):
+        for q in queries:
+            start = time.perf_counter()
+            fn(q)
+            samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        product = load_app(os.path.join(tmp, 'products.db'))
+        rng = random.Random(args.seed)
+        vocabulary = make_vocabulary(rng)
+        queries = make_queries(rng, vocabulary)
+        start = time.perf_counter()
+        seed(product, args.products, rng, vocabulary)
+        print(f'seeded {args.products} products in {time.perf_counter() - start:.1f}s')
+
+        client = product.app.test_client()
+
+        def fts(q):
+            response = client.get('/products/search', query_string={'q': q, 'limit': 20})
+            assert response.status_code == 200, response.get_json()
+
+        def like_scan(q):
+            with product.app.app_context():
+                pattern = f'%{q}%'
+                product.Product.query.filter(product.db.or_(
+                    product.Product.name.ilike(pattern),
+                    product.Product.description.ilike(pattern),
+                    product.Product.category.ilike(pattern),
+                )).limit(20).all()
+
+        for label, fn in [('fts5 /products/search', fts), ('LIKE scan (baseline)', like_scan)]:
+            samples = time_calls(fn, queries, args.repeat)
+            print(f'{label:24} p50={statistics.median(samples):7.2f}ms '
+                  f'p95={percentile(samples, 95):7.2f}ms p99={percentile(samples, 99):7.2f}ms')
+
+
+if __name__ == '__main__':
+    main()
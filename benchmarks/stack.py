@@ -0,0 +1,87 @@
+"""Boot all six services in one process for benchmarks.
+
+Each Flask app is imported with its own throwaway SQLite database and served
+by a threaded Werkzeug server on a free loopback port. The services address
+each other by their compose hostnames (``http://product-service:5003``), so
+every ``ServiceClient`` session gets an adapter that rewrites those hosts to
+the local ports.
+"""
+import importlib
+import logging
+import os
+import sys
+import threading
+
+from requests.adapters import HTTPAdapter
+from werkzeug.serving import make_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVICES = [
+    # (compose host, directory, module)
+    ('auth-service:5001', 'auth-service', 'app'),
+    ('user-service:5002', 'user-service', 'user'),
+    ('product-service:5003', 'product-service', 'product'),
+    ('cart-service:5004', 'cart-service', 'cart'),
+    ('order-service:5005', 'order-service', 'order'),
+    ('payment-service:5006', 'payment-service', 'payment'),
+]
+
+
+class LocalHostAdapter(HTTPAdapter):
+    """Pooled adapter that sends compose hostnames to local ports."""
+
+    def __init__(self, hosts, **kwargs):
+        self.hosts = hosts
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        scheme, rest = request.url.split('://', 1)
+        host, _, path = rest.partition('/')
+        if host in self.hosts:
+            request.url = f'{scheme}://{self.hosts[host]}/{path}'
+        return super().send(request, **kwargs)
+
+
+class Stack:
+    def __init__(self, data_dir, env=None):
+        self.data_dir = data_dir
+        self.env = env or {}
+        self.modules = {}
+        self.urls = {}
+        self._servers = []
+
+    def start(self):
+        os.environ.update(self.env)
+        # Per-request access lines would drown out the report
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        sys.path.insert(0, ROOT)
+        for host, directory, module_name in SERVICES:
+            os.environ['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(self.data_dir, module_name)}.db'
+            sys.path.insert(0, os.path.join(ROOT, directory))
+            self.modules[host] = importlib.import_module(module_name)
+
+        for host, module in self.modules.items():
+            server = make_server('127.0.0.1', 0, module.app, threaded=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self._servers.append(server)
+            self.urls[host] = f'127.0.0.1:{server.port}'
+
+        from common import http
+        for client in http._clients.values():
+            adapter = LocalHostAdapter(self.urls, pool_connections=1, pool_maxsize=http.POOL_SIZE)
+            client.session.mount('http://', adapter)
+
+        payment = self.modules['payment-service:5006']
+        if payment.event_bus is not None:
+            self.modules['order-service:5005'].subscribe_local(payment.event_bus)
+        payment.payment_workers.start()
+        payment.outbox_relay.start()
+        return self
+
+    def url(self, host):
+        return f'http://{self.urls[host]}'
+
+    def stop(self):
+        for server in self._servers:
+            server.shutdown()
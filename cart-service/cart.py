@@ -1,14 +1,32 @@
+import common.patching  # noqa: F401 - gevent patching must precede all other imports
 from flask import Flask, request, jsonify
-from flask_sqlalchemy import SQLAlchemy
 import os
-import requests
+
+from common.auth import create_verifier
+from common.db import create_db
+from common.http import get_client
+from common.metrics import init_metrics
+from common.serving import run
+from common.tracing import init_tracing
+from store import create_cart_store, create_id_counter_model
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'supersecretkey123')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('SQLALCHEMY_DATABASE_URI', 'sqlite:///cart.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['JWT_SECRET_KEY'] = os.environ.get('SECRET_KEY', 'supersecretkey123')
+app.config['TOKEN_REVOCATION_CHECK'] = os.environ.get('TOKEN_REVOCATION_CHECK', '0') == '1'
+app.config['CART_STORE'] = os.environ.get('CART_STORE', 'db')
+app.config['CART_FLUSH_INTERVAL'] = float(os.environ.get('CART_FLUSH_INTERVAL', '1.0'))
+app.config['CART_FLUSH_THRESHOLD'] = int(os.environ.get('CART_FLUSH_THRESHOLD', '500'))
+app.config['CART_IDLE_TTL'] = float(os.environ.get('CART_IDLE_TTL', '900'))
+app.config['CART_MAX_CARTS'] = int(os.environ.get('CART_MAX_CARTS', '10000'))
 
-db = SQLAlchemy(app)
+db = create_db(app)
+init_metrics(app, db)
+init_tracing(app, db, 'cart-service')
+token_verifier = create_verifier(app)
+product_service = get_client('http://product-service:5003')
 
 class CartItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -16,30 +34,89 @@ class CartItem(db.Model):
     product_id = db.Column(db.Integer, nullable=False)
     quantity = db.Column(db.Integer, default=1)
     created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+    
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'product_id', name='uq_cart_item_user_product'),
+    )
+
+CartIdCounter = create_id_counter_model(db)
 
 with app.app_context():
     db.create_all()
 
+cart_store = create_cart_store(app, db, CartItem, CartIdCounter)
+
 def verify_token(token):
-    try:
-        response = requests.post('http://auth-service:5001/verify', 
-                               headers={'Authorization': f'Bearer {token}'})
-        return response.status_code == 200, response.json()
-    except:
-        return False, {}
+    return token_verifier.verify(token)
 
-def get_product_details(product_id):
+# product-service's limit on ids per /products/batch call
+PRODUCT_BATCH_SIZE = 500
+
+def get_products_batch(product_ids):
+    """Fetch products in as few calls as possible; returns {product_id: product} or None.
+
+    Unknown ids are left out of the result; None means product-service failed.
+    """
+    product_ids = list(product_ids)
+    products = {}
     try:
-        response = requests.get(f'http://product-service:5003/products/{product_id}')
-        if response.status_code == 200:
-            return response.json()
-        return None
+        for start in range(0, len(product_ids), PRODUCT_BATCH_SIZE):
+            response = product_service.post(
+                '/products/batch', json={'ids': product_ids[start:start + PRODUCT_BATCH_SIZE]},
+                idempotent=True)
+            if response.status_code != 200:
+                return None
+            products.update((int(product_id), product)
+                            for product_id, product in response.json()['products'].items())
+        return products
     except:
         return None
 
+def parse_product_id(value):
+    """Return ``value`` as an integer id (int or digit string), or None."""
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    return None
+
+MAX_BATCH_OPERATIONS = 200
+BATCH_OPERATIONS = ('add', 'set', 'remove')
+
+def validate_operation(operation, products):
+    """Return an error message for an invalid batch operation, or None."""
+    op = operation.get('op')
+    if op not in BATCH_OPERATIONS:
+        return f"op must be one of {', '.join(BATCH_OPERATIONS)}"
+    
+    if op == 'remove':
+        if operation.get('item_id') is None and operation.get('product_id') is None:
+            return 'item_id or product_id required'
+        for key in ('item_id', 'product_id'):
+            if operation.get(key) is not None and parse_product_id(operation[key]) is None:
+                return f'Invalid {key}'
+        return None
+    
+    quantity = operation.get('quantity', 1)
+    if not isinstance(quantity, int) or quantity < 0 or (op == 'add' and quantity == 0):
+        return 'Invalid quantity'
+    if parse_product_id(operation.get('product_id')) not in products:
+        return 'Product not found'
+    return None
+
+@app.before_request
+def start_background_workers():
+    # No-op once running in this process; restarts the thread after a fork
+    cart_store.start()
+
 @app.route('/health', methods=['GET'])
 def health_check():
-    return jsonify({'status': 'healthy', 'service': 'cart-service'})
+    return jsonify({
+        'status': 'healthy',
+        'service': 'cart-service',
+        'token_cache': token_verifier.stats(),
+        'cart_store': cart_store.stats()
+    })
 
 @app.route('/cart', methods=['POST'])
 def add_to_cart():
@@ -55,21 +132,22 @@ def add_to_cart():
         product_id = data.get('product_id')
         quantity = data.get('quantity', 1)
         
+        if product_id is None:
+            return jsonify({'error': 'product_id required'}), 400
+        product_id = parse_product_id(product_id)
+        if product_id is None:
+            return jsonify({'error': 'product_id must be an integer'}), 400
+        if not isinstance(quantity, int) or quantity < 1:
+            return jsonify({'error': 'Invalid quantity'}), 400
+        
         # Check if product exists
-        product = get_product_details(product_id)
-        if not product:
+        products = get_products_batch([product_id])
+        if products is None:
+            return jsonify({'error': 'Product service unavailable'}), 503
+        if not products:
             return jsonify({'error': 'Product not found'}), 404
         
-        # Check if item already in cart
-        existing_item = CartItem.query.filter_by(user_id=user_id, product_id=product_id).first()
-        
-        if existing_item:
-            existing_item.quantity += quantity
-        else:
-            cart_item = CartItem(user_id=user_id, product_id=product_id, quantity=quantity)
-            db.session.add(cart_item)
-        
-        db.session.commit()
+        cart_store.add(int(user_id), product_id, quantity)
         
         return jsonify({'message': 'Item added to cart successfully'}), 201
         
@@ -85,24 +163,29 @@ def get_cart():
         if not is_valid:
             return jsonify({'error': 'Invalid token'}), 401
         
-        user_id = auth_data.get('user_id')
-        cart_items = CartItem.query.filter_by(user_id=user_id).all()
+        user_id = int(auth_data.get('user_id'))
+        cart_items = cart_store.get_items(user_id)
+        
+        products = get_products_batch({item['product_id'] for item in cart_items})
+        if products is None:
+            return jsonify({'error': 'Product service unavailable'}), 503
         
         cart_data = []
         total_amount = 0
         
         for item in cart_items:
-            product = get_product_details(item.product_id)
+            product = products.get(item['product_id'])
             if product:
-                item_total = product['price'] * item.quantity
+                item_total = product['price'] * item['quantity']
                 total_amount += item_total
                 
                 cart_data.append({
-                    'id': item.id,
-                    'product_id': item.product_id,
+                    'id': item['id'],
+                    'product_id': item['product_id'],
                     'product_name': product['name'],
+                    'image_url': product.get('image_url'),
                     'price': product['price'],
-                    'quantity': item.quantity,
+                    'quantity': item['quantity'],
                     'total': item_total
                 })
         
@@ -114,6 +197,64 @@ def get_cart():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/cart/batch', methods=['POST'])
+def batch_update_cart():
+    try:
+        token = request.headers.get('Authorization', '').replace('Bearer ', '')
+        is_valid, auth_data = verify_token(token)
+        
+        if not is_valid:
+            return jsonify({'error': 'Invalid token'}), 401
+        
+        user_id = int(auth_data.get('user_id'))
+        operations = (request.get_json() or {}).get('operations')
+        
+        if not isinstance(operations, list) or not operations:
+            return jsonify({'error': 'operations must be a non-empty list'}), 400
+        if len(operations) > MAX_BATCH_OPERATIONS:
+            return jsonify({'error': f'At most {MAX_BATCH_OPERATIONS} operations per request'}), 400
+        operations = [op if isinstance(op, dict) else {} for op in operations]
+        
+        # Validate every referenced product with one lookup
+        product_ids = {parse_product_id(op.get('product_id')) for op in operations
+                       if op.get('op') in ('add', 'set')}
+        products = get_products_batch(product_ids - {None})
+        if products is None:
+            return jsonify({'error': 'Product service unavailable'}), 503
+        
+        results = []
+        changes = []
+        for index, operation in enumerate(operations):
+            op = operation.get('op')
+            error = validate_operation(operation, products)
+            # Ids are matched as ints by both cart stores, so digit strings are converted
+            product_id = parse_product_id(operation.get('product_id'))
+            item_id = parse_product_id(operation.get('item_id'))
+            result = {'index': index, 'op': op,
+                      'product_id': operation.get('product_id') if product_id is None else product_id,
+                      'status': 'error' if error else 'ok'}
+            if error:
+                result['error'] = error
+                results.append(result)
+                continue
+            
+            changes.append((op, product_id, operation.get('quantity', 1), item_id))
+            results.append(result)
+        
+        # All valid operations are applied together
+        valid_results = [result for result in results if result['status'] == 'ok']
+        for result, applied in zip(valid_results, cart_store.apply(user_id, changes)):
+            if not applied and result['op'] == 'remove':
+                result.update(status='error', error='Cart item not found')
+        
+        return jsonify({
+            'results': results,
+            'applied': sum(1 for result in results if result['status'] == 'ok')
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/cart/<int:item_id>', methods=['DELETE'])
 def remove_from_cart(item_id):
     try:
@@ -123,19 +264,15 @@ def remove_from_cart(item_id):
         if not is_valid:
             return jsonify({'error': 'Invalid token'}), 401
         
-        user_id = auth_data.get('user_id')
-        cart_item = CartItem.query.filter_by(id=item_id, user_id=user_id).first()
+        user_id = int(auth_data.get('user_id'))
         
-        if not cart_item:
+        if not cart_store.remove_item(user_id, item_id):
             return jsonify({'error': 'Cart item not found'}), 404
         
-        db.session.delete(cart_item)
-        db.session.commit()
-        
         return jsonify({'message': 'Item removed from cart'}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5004, debug=True)
+    run(app, 5004, db=db, on_worker_start=[cart_store.start])
@@ -0,0 +1,413 @@
+"""Cart storage backends.
+
+``CART_STORE`` selects how cart-service keeps carts:
+
+- ``db`` (default): every mutation is its own transaction on ``cart_item``
+  and every read queries it.
+- ``memory``: the primary copy of each active cart lives in process memory.
+  Mutations mark lines dirty and a background thread writes them behind to
+  ``cart_item`` every ``CART_FLUSH_INTERVAL`` seconds, or sooner once
+  ``CART_FLUSH_THRESHOLD`` lines are dirty. A cart missing from memory (cold
+  start, or evicted after ``CART_IDLE_TTL`` seconds idle or beyond
+  ``CART_MAX_CARTS``) is loaded from the table on first use.
+
+The memory store must be the only writer, so it needs a single worker
+process (``WEB_CONCURRENCY=1``; threads or greenlets are fine). Changes made
+within the last flush interval are lost if the process is killed; a normal
+shutdown flushes everything first.
+
+New lines need an id before they are written, so the memory store reserves
+ids from the database in blocks: from the ``cart_item`` sequence on
+PostgreSQL, and through ``cart_id_counter`` elsewhere. A reserved id is never
+handed out again, even after a restart.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+logger = logging.getLogger(__name__)
+
+UPSERT_CHUNK_SIZE = 500
+ID_BLOCK_SIZE = 100
+
+
+def create_id_counter_model(db):
+    class CartIdCounter(db.Model):
+        """Highest id reserved per table, for databases without sequences."""
+        __tablename__ = 'cart_id_counter'
+        name = db.Column(db.String(100), primary_key=True)
+        value = db.Column(db.BigInteger, nullable=False)
+
+    return CartIdCounter
+
+
+def upsert_stmt(db, model, rows, increment=False, with_id=False):
+    """INSERT ... ON CONFLICT (user_id, product_id) for ``rows``.
+
+    Conflicting lines get the new quantity, or have it added with ``increment``.
+    With ``with_id`` they also take the row's ``id``, so a line that was
+    removed and added again keeps the id it was given in memory.
+    """
+    insert = postgresql.insert if db.engine.dialect.name == 'postgresql' else sqlite.insert
+    stmt = insert(model).values(rows)
+    quantity = model.quantity + stmt.excluded.quantity if increment else stmt.excluded.quantity
+    values = {'quantity': quantity}
+    if with_id:
+        values['id'] = stmt.excluded.id
+    return stmt.on_conflict_do_update(index_elements=['user_id', 'product_id'], set_=values)
+
+
+class CartStore(ABC):
+    """Common interface; ``apply`` is the only mutation backends implement.
+
+    ``changes`` is a list of ``(op, product_id, quantity, item_id)`` tuples
+    with ``op`` one of ``add``, ``set`` or ``remove`` (``set`` to zero
+    removes). All changes are applied together; the result has one flag per
+    change, False for a ``remove`` that matched nothing.
+    """
+
+    def start(self):
+        pass
+
+    def add(self, user_id, product_id, quantity):
+        self.apply(user_id, [('add', product_id, quantity, None)])
+
+    def remove_item(self, user_id, item_id):
+        return self.apply(user_id, [('remove', None, 0, item_id)])[0]
+
+    @abstractmethod
+    def get_items(self, user_id):
+        """Return the cart as ``[{'id', 'product_id', 'quantity'}]`` in insertion order."""
+
+    @abstractmethod
+    def apply(self, user_id, changes):
+        """Apply ``changes`` together; returns one applied flag per change."""
+
+    def stats(self):
+        return {'backend': self.backend}
+
+
+class DatabaseCartStore(CartStore):
+    backend = 'db'
+
+    def __init__(self, db, model):
+        self.db = db
+        self.model = model
+
+    def get_items(self, user_id):
+        items = self.model.query.filter_by(user_id=user_id).order_by(self.model.id).all()
+        return [{'id': item.id, 'product_id': item.product_id, 'quantity': item.quantity}
+                for item in items]
+
+    def apply(self, user_id, changes):
+        CartItem = self.model
+        applied = []
+        try:
+            for op, product_id, quantity, item_id in changes:
+                if op == 'add' or (op == 'set' and quantity > 0):
+                    # Insert or update atomically; concurrent adds cannot duplicate the row
+                    row = {'user_id': user_id, 'product_id': product_id, 'quantity': quantity}
+                    self.db.session.execute(upsert_stmt(self.db, CartItem, [row], increment=op == 'add'))
+                    applied.append(True)
+                    continue
+                query = CartItem.query.filter_by(user_id=user_id)
+                if item_id is not None:
+                    query = query.filter_by(id=item_id)
+                else:
+                    query = query.filter_by(product_id=product_id)
+                applied.append(query.delete(synchronize_session=False) > 0)
+            self.db.session.commit()
+        except Exception:
+            self.db.session.rollback()
+            raise
+        return applied
+
+
+class MemoryCartStore(CartStore):
+    """Carts held in memory and written behind to the database."""
+
+    backend = 'memory'
+
+    def __init__(self, app, db, model, counter_model, flush_interval=1.0, flush_threshold=500,
+                 idle_ttl=900, max_carts=10000):
+        self.app = app
+        self.db = db
+        self.model = model
+        self.counter_model = counter_model
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.idle_ttl = idle_ttl
+        self.max_carts = max_carts
+
+        # user_id -> {product_id: [item_id, quantity]}, least recently used first
+        self._carts = OrderedDict()
+        self._last_used = {}
+        # user_id -> product ids whose stored row is out of date
+        self._dirty = {}
+        self._dirty_count = 0
+        self._free_ids = deque()
+        self._generation = 0
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # Guards _free_ids; refills hit the database, so never under _lock
+        self._id_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+
+        self.loads = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.flush_failures = 0
+        self.evictions = 0
+        self.last_flush_ms = 0.0
+
+    def start(self):
+        """Start the write-behind thread (again, if this process was forked)."""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            first_start = self._pid is None
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='cart-write-behind', daemon=True)
+            self._thread.start()
+        if first_start:
+            atexit.register(self.stop)
+
+    def stop(self, timeout=None):
+        """Stop the thread and flush whatever is still dirty."""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        with self.app.app_context():
+            self.flush()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                with self.app.app_context():
+                    self.flush()
+                # Only this thread evicts, so a cart is never dropped while its
+                # rows are being written
+                self.evict()
+            except Exception:
+                logger.exception('cart write-behind failed')
+
+    def _take_ids(self, count):
+        # Row ids are assigned here so clients can address lines before they
+        # are written; called without self._lock so a refill blocks no cart
+        if not count:
+            return []
+        with self._id_lock:
+            while len(self._free_ids) < count:
+                self._free_ids.extend(self._reserve_ids(max(ID_BLOCK_SIZE, count)))
+            return [self._free_ids.popleft() for _ in range(count)]
+
+    def _reserve_ids(self, count):
+        """Reserve ``count`` unused row ids in the database, in its own transaction."""
+        CartItem = self.model
+        table = CartItem.__tablename__
+        with self.db.engine.begin() as conn:
+            if conn.dialect.name == 'postgresql':
+                # The same sequence CART_STORE=db inserts draw from
+                return conn.execute(self.db.text(
+                    "SELECT nextval(pg_get_serial_sequence(:table, 'id')) FROM generate_series(1, :count)"),
+                    {'table': table, 'count': count}).scalars().all()
+
+            Counter = self.counter_model
+            reserved = conn.execute(self.db.select(Counter.value).where(Counter.name == table)).scalar()
+            # Rows inserted by CART_STORE=db do not move the counter
+            highest = conn.execute(self.db.select(self.db.func.max(CartItem.id))).scalar() or 0
+            start = max(reserved or 0, highest)
+            if reserved is None:
+                conn.execute(self.db.insert(Counter).values(name=table, value=start + count))
+            else:
+                conn.execute(self.db.update(Counter).where(Counter.name == table)
+                             .values(value=start + count))
+            return list(range(start + 1, start + count + 1))
+
+    def _ensure_loaded(self, user_id):
+        CartItem = self.model
+        while True:
+            with self._lock:
+                if user_id in self._carts:
+                    return
+                generation = self._generation
+
+            # The loaded copy becomes authoritative, so never read it from a replica
+            primary = {'bind': self.db.engine}
+            rows = self.db.session.execute(
+                self.db.select(CartItem.id, CartItem.product_id, CartItem.quantity)
+                .where(CartItem.user_id == user_id), bind_arguments=primary
+            ).all()
+
+            with self._lock:
+                if user_id in self._carts:
+                    return
+                # An eviction since the query started may have followed a flush
+                # of this cart, so the rows could be stale; read them again
+                if generation == self._generation:
+                    self._carts[user_id] = {row.product_id: [row.id, row.quantity] for row in rows}
+                    self._last_used[user_id] = time.monotonic()
+                    self.loads += 1
+                    return
+
+    def _acquire_cart(self, user_id):
+        """Return the user's cart with self._lock held, loading it if needed."""
+        while True:
+            self._ensure_loaded(user_id)
+            self._lock.acquire()
+            cart = self._carts.get(user_id)
+            if cart is not None:
+                self._carts.move_to_end(user_id)
+                self._last_used[user_id] = time.monotonic()
+                return cart
+            # Evicted in between; load it again
+            self._lock.release()
+
+    def get_items(self, user_id):
+        cart = self._acquire_cart(user_id)
+        try:
+            lines = sorted(cart.items(), key=lambda line: line[1][0])
+        finally:
+            self._lock.release()
+        return [{'id': item_id, 'product_id': product_id, 'quantity': quantity}
+                for product_id, (item_id, quantity) in lines]
+
+    def apply(self, user_id, changes):
+        applied = []
+        # One id per line that may be created; ids left over are simply unused
+        ids = deque(self._take_ids(sum(1 for op, _, quantity, _ in changes
+                                       if op == 'add' or (op == 'set' and quantity > 0))))
+        cart = self._acquire_cart(user_id)
+        try:
+            dirty = self._dirty.setdefault(user_id, set())
+            before = len(dirty)
+            for op, product_id, quantity, item_id in changes:
+                if op == 'add' or (op == 'set' and quantity > 0):
+                    line = cart.get(product_id)
+                    if line is None:
+                        cart[product_id] = [ids.popleft(), quantity]
+                    else:
+                        line[1] = line[1] + quantity if op == 'add' else quantity
+                    dirty.add(product_id)
+                    applied.append(True)
+                    continue
+                if item_id is not None:
+                    product_id = next((pid for pid, line in cart.items() if line[0] == item_id), None)
+                removed = cart.pop(product_id, None) is not None
+                if removed:
+                    dirty.add(product_id)
+                applied.append(removed)
+            if not dirty:
+                del self._dirty[user_id]
+            self._dirty_count += len(dirty) - before
+            over_threshold = self._dirty_count >= self.flush_threshold
+        finally:
+            self._lock.release()
+        if over_threshold:
+            self._wakeup.set()
+        return applied
+
+    def flush(self):
+        """Write every dirty line to the table; returns the number of rows written."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._dirty, self._dirty_count = self._dirty, {}, 0
+                upserts, deletes = [], {}
+                for user_id, product_ids in pending.items():
+                    cart = self._carts.get(user_id, {})
+                    for product_id in product_ids:
+                        line = cart.get(product_id)
+                        if line is None:
+                            deletes.setdefault(user_id, []).append(product_id)
+                        else:
+                            upserts.append({'id': line[0], 'user_id': user_id,
+                                            'product_id': product_id, 'quantity': line[1]})
+            if not pending:
+                return 0
+
+            start = time.perf_counter()
+            CartItem = self.model
+            session = self.db.session
+            try:
+                for user_id, product_ids in deletes.items():
+                    session.execute(self.db.delete(CartItem).where(
+                        CartItem.user_id == user_id, CartItem.product_id.in_(product_ids)))
+                for i in range(0, len(upserts), UPSERT_CHUNK_SIZE):
+                    session.execute(upsert_stmt(self.db, CartItem, upserts[i:i + UPSERT_CHUNK_SIZE],
+                                                with_id=True))
+                session.commit()
+            except Exception:
+                session.rollback()
+                # Put the lines back so the next flush writes their latest state
+                with self._lock:
+                    for user_id, product_ids in pending.items():
+                        dirty = self._dirty.setdefault(user_id, set())
+                        before = len(dirty)
+                        dirty.update(product_ids)
+                        self._dirty_count += len(dirty) - before
+                    self.flush_failures += 1
+                raise
+
+            written = len(upserts) + sum(len(product_ids) for product_ids in deletes.values())
+            self.flushes += 1
+            self.flushed_rows += written
+            self.last_flush_ms = round((time.perf_counter() - start) * 1000, 2)
+            return written
+
+    def evict(self):
+        """Drop clean carts idle for ``idle_ttl`` seconds or beyond ``max_carts``."""
+        deadline = time.monotonic() - self.idle_ttl
+        with self._lock:
+            for user_id in list(self._carts):
+                if len(self._carts) <= self.max_carts and self._last_used.get(user_id, 0) > deadline:
+                    # Carts are ordered by last use, so the rest are newer
+                    break
+                if user_id in self._dirty:
+                    continue
+                del self._carts[user_id]
+                self._last_used.pop(user_id, None)
+                self._generation += 1
+                self.evictions += 1
+
+    def stats(self):
+        return {
+            'backend': self.backend,
+            'carts': len(self._carts),
+            'dirty_lines': self._dirty_count,
+            'loads': self.loads,
+            'evictions': self.evictions,
+            'flushes': self.flushes,
+            'flushed_rows': self.flushed_rows,
+            'flush_failures': self.flush_failures,
+            'last_flush_ms': self.last_flush_ms,
+        }
+
+
+def create_cart_store(app, db, model, counter_model):
+    backend = app.config['CART_STORE']
+    if backend == 'db':
+        return DatabaseCartStore(db, model)
+    if backend == 'memory':
+        if (os.environ.get('SERVER_MODE') == 'production'
+                and os.environ.get('WEB_CONCURRENCY') != '1'):
+            raise RuntimeError('CART_STORE=memory needs a single worker process (WEB_CONCURRENCY=1)')
+        return MemoryCartStore(app, db, model, counter_model,
+                               flush_interval=app.config['CART_FLUSH_INTERVAL'],
+                               flush_threshold=app.config['CART_FLUSH_THRESHOLD'],
+                               idle_ttl=app.config['CART_IDLE_TTL'],
+                               max_carts=app.config['CART_MAX_CARTS'])
+    raise ValueError(f'Unknown CART_STORE {backend!r}')
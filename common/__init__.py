@@ -0,0 +1,6 @@
+"""Helpers shared by the Flask services.
+
+Each service image copies this package next to its entry point (see the
+service Dockerfiles), so it is importable as ``common`` inside the
+container. For local runs, put the repository root on ``PYTHONPATH``.
+"""
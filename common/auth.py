@@ -0,0 +1,111 @@
+"""Local verification of access tokens issued by auth-service.
+
+auth-service signs tokens with ``create_access_token`` (HS256, keyed by
+``SECRET_KEY``), so any service holding the same secret can check the
+signature and ``exp`` itself instead of calling ``/verify``. Tokens that
+verified once are kept in a bounded LRU until they expire.
+
+Internal endpoints called by other services (not users) check the
+``X-Internal-Token`` header instead; see ``internal_token``.
+"""
+import hashlib
+import hmac
+import os
+import time
+
+import jwt
+from flask import request
+
+from common.cache import TTLCache
+from common.http import get_client
+
+AUTH_SERVICE_URL = 'http://auth-service:5001'
+INTERNAL_TOKEN_HEADER = 'X-Internal-Token'
+
+
+def internal_token(app):
+    """Token services present to each other's internal endpoints.
+
+    ``INTERNAL_API_TOKEN`` if set, otherwise derived from ``SECRET_KEY`` so
+    services sharing that key agree without sending the key itself.
+    """
+    token = os.environ.get('INTERNAL_API_TOKEN')
+    if token:
+        return token
+    return hmac.new(app.config['SECRET_KEY'].encode(), b'internal-api', hashlib.sha256).hexdigest()
+
+
+def is_internal_request(app):
+    presented = request.headers.get(INTERNAL_TOKEN_HEADER, '')
+    return hmac.compare_digest(presented.encode(), internal_token(app).encode())
+
+
+def remote_verify(token):
+    """Ask auth-service whether ``token`` is still valid (e.g. not revoked)."""
+    try:
+        response = get_client(AUTH_SERVICE_URL).post(
+            '/verify', headers={'Authorization': f'Bearer {token}'}, idempotent=True)
+        return response.status_code == 200, response.json()
+    except Exception:
+        return False, {}
+
+
+class TokenVerifier:
+    """Verify JWTs locally, caching the ones that passed.
+
+    ``fallback`` is an optional callable with the ``remote_verify`` signature.
+    When set, it is consulted on every cache miss after the local checks pass
+    (revocation), and cached entries are re-checked at least every
+    ``revalidate_after`` seconds.
+    """
+
+    def __init__(self, secret, algorithms=('HS256',), maxsize=4096,
+                 fallback=None, revalidate_after=60):
+        self.secret = secret
+        self.algorithms = list(algorithms)
+        self.fallback = fallback
+        self.revalidate_after = revalidate_after
+        self.cache = TTLCache(maxsize=maxsize)
+
+    def verify(self, token):
+        if not token:
+            return False, {}
+
+        cached = self.cache.get(token)
+        if cached is not None:
+            return True, cached
+
+        try:
+            claims = jwt.decode(token, self.secret, algorithms=self.algorithms)
+        except jwt.PyJWTError:
+            return False, {}
+        if claims.get('type', 'access') != 'access':
+            return False, {}
+
+        auth_data = {'valid': True, 'user_id': claims.get('sub')}
+        expires_at = claims.get('exp')
+
+        if self.fallback is not None:
+            is_valid, remote_data = self.fallback(token)
+            if not is_valid:
+                return False, {}
+            auth_data = remote_data
+            revalidate_at = time.time() + self.revalidate_after
+            expires_at = min(expires_at, revalidate_at) if expires_at else revalidate_at
+
+        self.cache.set(token, auth_data, expires_at=expires_at)
+        return True, auth_data
+
+    def stats(self):
+        return self.cache.stats()
+
+
+def create_verifier(app):
+    """Build a verifier from the Flask app config.
+
+    ``TOKEN_REVOCATION_CHECK`` enables the remote ``/verify`` fallback.
+    """
+    fallback = remote_verify if app.config.get('TOKEN_REVOCATION_CHECK') else None
+    return TokenVerifier(app.config['JWT_SECRET_KEY'],
+                         maxsize=app.config.get('TOKEN_CACHE_SIZE', 4096),
+                         fallback=fallback)
@@ -0,0 +1,109 @@
+"""Database setup shared by the services: connection pooling and read replicas.
+
+``create_db(app)`` replaces ``SQLAlchemy(app)``. Pool settings come from the
+environment so each service can be sized for its worker model:
+
+- ``DB_POOL_SIZE`` / ``DB_MAX_OVERFLOW``: connections kept open per worker
+  process, and extra ones allowed under bursts (default 5 / 10)
+- ``DB_POOL_TIMEOUT``: seconds to wait for a free connection (default 10)
+- ``DB_POOL_RECYCLE``: reconnect connections older than this (default 1800)
+- ``DB_POOL_PRE_PING``: test connections on checkout (default on)
+
+``DB_REPLICA_URIS`` is an optional comma-separated list of read replicas.
+ORM reads made while handling a GET or HEAD request go to one of them,
+picked per request. Everything else uses the primary: writes, requests with
+other methods, background threads, and any read in a request after it has
+written. After a write request from the edge the client also gets a cookie
+that keeps its reads on the primary for ``DB_READ_YOUR_WRITES_SECONDS``
+(default 5), to cover replication lag. Calls between services (marked by
+``ServiceClient``) never get it.
+
+Locally, replicas can be SQLite files (e.g. copies of the primary).
+"""
+import os
+import random
+import time
+
+from flask import g, has_request_context, request
+from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+
+from common.http import SERVICE_CALL_HEADER
+
+READ_METHODS = ('GET', 'HEAD')
+STICKY_COOKIE = 'db_read_primary_until'
+
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def engine_options(uri):
+    options = {
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', '1') == '1',
+        'pool_recycle': env_int('DB_POOL_RECYCLE', 1800),
+    }
+    if not uri.startswith('sqlite'):
+        # SQLite engines keep Flask-SQLAlchemy's pool defaults
+        options.update(
+            pool_size=env_int('DB_POOL_SIZE', 5),
+            max_overflow=env_int('DB_MAX_OVERFLOW', 10),
+            pool_timeout=env_int('DB_POOL_TIMEOUT', 10),
+        )
+    return options
+
+
+def replica_uris():
+    return [uri.strip() for uri in os.environ.get('DB_REPLICA_URIS', '').split(',') if uri.strip()]
+
+
+class RoutingSession(Session):
+    """Session that sends reads to the request's replica, if one was chosen."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_request_context():
+            replica = g.get('db_replica')
+            if replica is not None:
+                if self._flushing or getattr(clause, 'is_dml', False):
+                    # From here on this request reads its own writes from the primary
+                    g.db_replica = None
+                    g.db_wrote = True
+                else:
+                    return self._db.engines[replica]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def create_db(app):
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    replicas = {f'replica_{i}': replica_uri for i, replica_uri in enumerate(replica_uris())}
+
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(uri))
+    if replicas:
+        app.config['SQLALCHEMY_BINDS'] = dict(app.config.get('SQLALCHEMY_BINDS') or {}, **replicas)
+    db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+    if not replicas:
+        return db
+
+    sticky_seconds = float(os.environ.get('DB_READ_YOUR_WRITES_SECONDS', '5'))
+    replica_keys = list(replicas)
+
+    @app.before_request
+    def choose_replica():
+        try:
+            primary_until = float(request.cookies.get(STICKY_COOKIE, 0))
+        except ValueError:
+            primary_until = 0
+        if request.method in READ_METHODS and primary_until < time.time():
+            g.db_replica = random.choice(replica_keys)
+
+    @app.after_request
+    def keep_reads_on_primary(response):
+        if request.headers.get(SERVICE_CALL_HEADER):
+            return response
+        if (request.method not in READ_METHODS or g.get('db_wrote')) and response.status_code < 400:
+            response.set_cookie(STICKY_COOKIE, str(time.time() + sticky_seconds),
+                                max_age=int(sticky_seconds) + 1, httponly=True, samesite='Lax')
+        return response
+
+    return db
+
@@ -0,0 +1,178 @@
+"""Pooled HTTP client for calls between services.
+
+One ``ServiceClient`` per upstream base URL keeps a keep-alive connection
+pool, applies connect/read timeouts, retries idempotent calls with jittered
+backoff and trips a circuit breaker when the upstream keeps failing.
+"""
+import os
+import random
+import threading
+import time
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from common.metrics import observe_upstream
+from common.tracing import outbound_headers, start_span
+
+CONNECT_TIMEOUT = float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', '1.0'))
+READ_TIMEOUT = float(os.environ.get('UPSTREAM_READ_TIMEOUT', '5.0'))
+MAX_RETRIES = int(os.environ.get('UPSTREAM_MAX_RETRIES', '2'))
+POOL_SIZE = int(os.environ.get('UPSTREAM_POOL_SIZE', '20'))
+
+# Marks requests made by ServiceClient, as opposed to ones from the edge
+SERVICE_CALL_HEADER = 'X-Service-Call'
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+RETRY_STATUSES = frozenset([502, 503, 504])
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of calling an upstream whose breaker is open."""
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker with a single half-open probe."""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+    def release(self):
+        """End a call that says nothing about upstream health; frees the probe."""
+        with self._lock:
+            self._probing = False
+
+
+class ServiceClient:
+    def __init__(self, base_url, timeout=None, max_retries=MAX_RETRIES,
+                 backoff=0.05, pool_size=POOL_SIZE, breaker=None):
+        self.base_url = base_url.rstrip('/')
+        self.upstream = self.base_url.split('://', 1)[-1]
+        self.timeout = timeout or (CONNECT_TIMEOUT, READ_TIMEOUT)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.session = requests.Session()
+        self.session.headers[SERVICE_CALL_HEADER] = '1'
+        # Cookies are per end user; a shared client must not collect and replay them
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _attempt(self, method, path, kwargs):
+        """One call as a traced client span; returns (response, connection_error)."""
+        with start_span(f'{method} {self.upstream}', kind='client',
+                        **{'http.url': self.base_url + path}) as span:
+            headers = dict(kwargs.get('headers') or {})
+            headers.update(outbound_headers(span))
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, self.base_url + path,
+                                                **dict(kwargs, headers=headers))
+            except (requests.ConnectionError, requests.Timeout) as e:
+                outcome = 'timeout' if isinstance(e, requests.Timeout) else 'error'
+                observe_upstream(self.upstream, method, outcome, time.perf_counter() - started)
+                self.breaker.record_failure()
+                span.status = 'error'
+                span.attributes['error'] = outcome
+                return None, e
+            except BaseException:
+                # e.g. TooManyRedirects or InvalidURL: not counted, but a
+                # half-open probe must not stay claimed or the breaker never closes
+                self.breaker.release()
+                span.status = 'error'
+                raise
+
+            observe_upstream(self.upstream, method, response.status_code,
+                             time.perf_counter() - started)
+            span.attributes['http.status_code'] = response.status_code
+            if response.status_code >= 500:
+                self.breaker.record_failure()
+                span.status = 'error'
+            else:
+                self.breaker.record_success()
+            return response, None
+
+    def request(self, method, path, idempotent=None, **kwargs):
+        """Send a request; ``idempotent`` overrides the method-based retry rule."""
+        method = method.upper()
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        kwargs.setdefault('timeout', self.timeout)
+        attempts = 1 + (self.max_retries if idempotent else 0)
+
+        for attempt in range(attempts):
+            if not self.breaker.allow():
+                observe_upstream(self.upstream, method, 'circuit_open', 0.0)
+                raise CircuitOpenError(f'circuit open for {self.base_url}')
+            response, error = self._attempt(method, path, kwargs)
+            if response is None:
+                if attempt + 1 == attempts:
+                    raise error
+            elif response.status_code not in RETRY_STATUSES or attempt + 1 == attempts:
+                return response
+            # Full jitter: sleep somewhere in [0, backoff * 2^attempt)
+            time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request('PUT', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request('DELETE', path, **kwargs)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(base_url, **kwargs):
+    """Return the process-wide client for ``base_url``, creating it on first use."""
+    with _clients_lock:
+        client = _clients.get(base_url)
+        if client is None:
+            client = _clients[base_url] = ServiceClient(base_url, **kwargs)
+        return client
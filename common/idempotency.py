@@ -0,0 +1,175 @@
+"""``Idempotency-Key`` support for non-idempotent POST endpoints.
+
+The first request with a given key (per user) records a fingerprint of the
+request and, once the view returns, the serialized response. Replays with
+the same key get the stored response without running the view again; a
+duplicate that arrives while the first is still running waits for it.
+Keys expire after ``ttl`` seconds and are purged lazily.
+
+Each claim carries a random ``token``. The response is stored only if the
+key still carries that token when the view returns; a key that expired or
+was taken over in the meantime belongs to its new holder.
+"""
+import functools
+import hashlib
+import json
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from flask import jsonify, make_response, request
+from sqlalchemy.dialects import postgresql, sqlite
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'Idempotency-Key'
+
+
+def create_idempotency_model(db):
+    class IdempotencyKey(db.Model):
+        __tablename__ = 'idempotency_key'
+        scope = db.Column(db.String(100), primary_key=True)
+        key = db.Column(db.String(255), primary_key=True)
+        fingerprint = db.Column(db.String(64), nullable=False)
+        token = db.Column(db.String(36))
+        status = db.Column(db.String(20), nullable=False, default='in_progress')
+        response_status = db.Column(db.Integer)
+        response_body = db.Column(db.Text)
+        response_headers = db.Column(db.Text)
+        created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+        expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    return IdempotencyKey
+
+
+def request_fingerprint():
+    digest = hashlib.sha256()
+    digest.update(request.method.encode())
+    digest.update(request.path.encode())
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+class IdempotencyStore:
+    """Decorate views with ``@store.idempotent(scope)``.
+
+    ``scope()`` returns the caller's identity (e.g. user id) or None, in which
+    case the view runs without idempotency handling.
+    """
+
+    # Response headers worth replaying
+    STORED_HEADERS = ('Location',)
+
+    def __init__(self, db, model, ttl=86400, wait_timeout=10.0, lock_timeout=60.0,
+                 cleanup_interval=300.0):
+        self.db = db
+        self.model = model
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self.lock_timeout = lock_timeout
+        self.cleanup_interval = cleanup_interval
+        self.replays = 0
+        self._last_cleanup = 0.0
+
+    def idempotent(self, scope):
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                key = request.headers.get(HEADER)
+                owner = scope() if key else None
+                if not key or owner is None:
+                    return view(*args, **kwargs)
+                if len(key) > 255:
+                    return jsonify({'error': f'{HEADER} too long'}), 400
+                return self._handle(str(owner), key, view, args, kwargs)
+            return wrapper
+        return decorator
+
+    def _handle(self, scope, key, view, args, kwargs):
+        fingerprint = request_fingerprint()
+        self._maybe_cleanup()
+
+        token = str(uuid.uuid4())
+        record = self._acquire(scope, key, fingerprint, token)
+        if record is not None:
+            return record
+
+        response = make_response(view(*args, **kwargs))
+        self.db.session.rollback()
+        Key = self.model
+        claim = (Key.scope == scope, Key.key == key, Key.token == token)
+        if response.status_code >= 500:
+            # Failed attempts are not remembered, so the client can retry
+            stmt = self.db.delete(Key).where(*claim)
+        else:
+            stmt = self.db.update(Key).where(*claim).values(
+                status='completed',
+                response_status=response.status_code,
+                response_body=response.get_data(as_text=True),
+                response_headers=json.dumps({
+                    name: response.headers[name] for name in self.STORED_HEADERS if name in response.headers
+                }),
+            )
+        if self.db.session.execute(stmt.execution_options(synchronize_session=False)).rowcount == 0:
+            # The view's work is done either way; only the stored copy is lost
+            logger.warning('%s %r expired or was taken over before its response was stored', HEADER, key)
+        self.db.session.commit()
+        return response
+
+    def _insert_claim(self, values):
+        """INSERT the claim unless the key exists; True if this request now holds it."""
+        insert = postgresql.insert if self.db.engine.dialect.name == 'postgresql' else sqlite.insert
+        stmt = insert(self.model).values(**values).on_conflict_do_nothing(index_elements=['scope', 'key'])
+        claimed = self.db.session.execute(stmt).rowcount == 1
+        self.db.session.commit()
+        return claimed
+
+    def _acquire(self, scope, key, fingerprint, token):
+        """Claim the key, or return the response to send instead of running the view."""
+        deadline = time.monotonic() + self.wait_timeout
+        delay = 0.02
+        while True:
+            now = datetime.utcnow()
+            if self._insert_claim(dict(
+                    scope=scope, key=key, fingerprint=fingerprint, token=token, status='in_progress',
+                    created_at=now, expires_at=now + timedelta(seconds=self.ttl))):
+                return None
+
+            existing = self.db.session.get(self.model, (scope, key), populate_existing=True)
+            if existing is None:
+                continue
+            if existing.expires_at <= now or (
+                    existing.status == 'in_progress'
+                    and existing.created_at <= now - timedelta(seconds=self.lock_timeout)):
+                # Expired, or abandoned by a worker that died mid-request; only
+                # remove that claim, not one another request just made
+                Key = self.model
+                self.db.session.execute(self.db.delete(Key).where(
+                    Key.scope == scope, Key.key == key, Key.token == existing.token
+                ).execution_options(synchronize_session=False))
+                self.db.session.commit()
+                continue
+            if existing.fingerprint != fingerprint:
+                return jsonify({'error': f'{HEADER} was already used for a different request'}), 422
+            if existing.status == 'completed':
+                self.replays += 1
+                response = make_response(existing.response_body, existing.response_status)
+                response.mimetype = 'application/json'
+                response.headers.update(json.loads(existing.response_headers or '{}'))
+                response.headers['Idempotent-Replayed'] = 'true'
+                return response
+            if time.monotonic() >= deadline:
+                return jsonify({'error': 'A request with this Idempotency-Key is still in progress'}), 409, {'Retry-After': '1'}
+            # Another request with this key is running; wait for its response
+            self.db.session.rollback()
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+
+    def _maybe_cleanup(self):
+        if time.monotonic() - self._last_cleanup < self.cleanup_interval:
+            return
+        self._last_cleanup = time.monotonic()
+        self.db.session.execute(
+            self.db.delete(self.model).where(self.model.expires_at <= datetime.utcnow()))
+        self.db.session.commit()
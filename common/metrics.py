@@ -0,0 +1,112 @@
+"""Prometheus metrics shared by the services.
+
+``init_metrics(app, db)`` adds ``GET /metrics`` and records:
+
+- request count and latency per route template, method and status
+- requests in flight
+- SQL statement latency per operation, via SQLAlchemy engine events
+- outbound call latency per upstream (``ServiceClient`` reports it through
+  ``observe_upstream``)
+
+Under gunicorn, set ``PROMETHEUS_MULTIPROC_DIR`` so ``/metrics`` aggregates
+all worker processes (``common.serving`` wires the cleanup hooks).
+"""
+import os
+import time
+
+from flask import Response, g, request
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge,
+                               Histogram, generate_latest, multiprocess)
+from sqlalchemy import event
+
+# Multiprocess metric values open their files as soon as they are created,
+# which is at import time here, before common.serving.run() gets to run
+if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REQUEST_COUNT = Counter(
+    'http_requests_total', 'HTTP requests handled',
+    ['method', 'route', 'status'])
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'HTTP request latency',
+    ['method', 'route', 'status'], buckets=LATENCY_BUCKETS)
+REQUESTS_IN_FLIGHT = Gauge(
+    'http_requests_in_flight', 'HTTP requests currently being handled',
+    multiprocess_mode='livesum')
+DB_QUERY_LATENCY = Histogram(
+    'db_query_duration_seconds', 'SQL statement latency',
+    ['operation'], buckets=LATENCY_BUCKETS)
+UPSTREAM_LATENCY = Histogram(
+    'upstream_request_duration_seconds', 'Latency of calls to other services',
+    ['upstream', 'method', 'status'], buckets=LATENCY_BUCKETS)
+
+
+def observe_upstream(upstream, method, status, seconds):
+    UPSTREAM_LATENCY.labels(upstream, method, str(status)).observe(seconds)
+
+
+def sql_operation(statement):
+    word = statement.lstrip().split(None, 1)
+    return word[0].upper() if word else 'UNKNOWN'
+
+
+def instrument_engine(engine):
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['query_start'].pop()
+        DB_QUERY_LATENCY.labels(sql_operation(statement)).observe(time.perf_counter() - started)
+
+    @event.listens_for(engine, 'handle_error')
+    def handle_error(context):
+        # Keep the start-time stack balanced when a statement fails
+        stack = context.connection.info.get('query_start') if context.connection is not None else None
+        if stack:
+            stack.pop()
+
+
+def metrics_payload():
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest()
+
+
+def init_metrics(app, db=None):
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+        REQUESTS_IN_FLIGHT.inc()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('metrics_start', None)
+        if started is not None:
+            REQUESTS_IN_FLIGHT.dec()
+            # Route templates keep label cardinality bounded (/products/<int:product_id>)
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            labels = (request.method, route, str(response.status_code))
+            REQUEST_COUNT.labels(*labels).inc()
+            REQUEST_LATENCY.labels(*labels).observe(time.perf_counter() - started)
+        return response
+
+    @app.teardown_request
+    def release_in_flight(exc):
+        # after_request is skipped for unhandled exceptions
+        if g.pop('metrics_start', None) is not None:
+            REQUESTS_IN_FLIGHT.dec()
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(metrics_payload(), mimetype=CONTENT_TYPE_LATEST)
+
+    if db is not None:
+        with app.app_context():
+            for engine in db.engines.values():
+                instrument_engine(engine)
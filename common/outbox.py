@@ -0,0 +1,231 @@
+"""Transactional outbox, relay and idempotent consumer helpers.
+
+A producer writes events into its own ``outbox_event`` table in the same
+transaction as the state change they describe. ``OutboxRelay`` delivers
+undelivered rows in batches through a pluggable transport and marks them
+delivered only after the transport accepted the batch, so delivery is
+at-least-once. Each server process runs a relay; on PostgreSQL a relay
+claims its batch with ``FOR UPDATE SKIP LOCKED`` so the others skip it. Consumers record the ids they have applied
+(``processed_event``) to make redelivery harmless.
+
+Transports:
+
+- ``HttpTransport`` POSTs batches to a consumer's ``/events`` endpoint.
+- ``LocalEventBus`` dispatches in-process to subscribed handlers; it is the
+  stand-in for running everything in one process without a broker. A batch
+  with a topic nobody subscribed to is refused, so it stays in the outbox
+  instead of being marked delivered and lost.
+"""
+import json
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+
+logger = logging.getLogger(__name__)
+
+
+def create_outbox_model(db):
+    class OutboxEvent(db.Model):
+        __tablename__ = 'outbox_event'
+        id = db.Column(db.Integer, primary_key=True)
+        event_id = db.Column(db.String(36), unique=True, nullable=False, default=lambda: str(uuid.uuid4()))
+        topic = db.Column(db.String(100), nullable=False)
+        key = db.Column(db.String(100))
+        payload = db.Column(db.Text, nullable=False)
+        created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+        delivered_at = db.Column(db.DateTime)
+        attempts = db.Column(db.Integer, default=0, nullable=False)
+        last_error = db.Column(db.String(500))
+
+        __table_args__ = (
+            db.Index('ix_outbox_event_delivered_at_id', 'delivered_at', 'id'),
+        )
+
+        def to_message(self):
+            return {
+                'id': self.event_id,
+                'topic': self.topic,
+                'key': self.key,
+                'payload': json.loads(self.payload),
+                'created_at': self.created_at.isoformat(),
+            }
+
+    return OutboxEvent
+
+
+def create_processed_event_model(db):
+    class ProcessedEvent(db.Model):
+        __tablename__ = 'processed_event'
+        event_id = db.Column(db.String(36), primary_key=True)
+        topic = db.Column(db.String(100), nullable=False)
+        processed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    return ProcessedEvent
+
+
+def add_event(session, model, topic, payload, key=None):
+    """Stage an event in the caller's transaction; it is sent after commit."""
+    event = model(topic=topic, key=None if key is None else str(key), payload=json.dumps(payload))
+    session.add(event)
+    return event
+
+
+def apply_events(db, processed_model, messages, handlers):
+    """Apply a batch of messages once each, in one transaction.
+
+    ``handlers`` maps topic to ``handler(payload)``; unknown topics are
+    acknowledged and skipped. Returns the ids that were applied now.
+    """
+    try:
+        return _apply_events(db, processed_model, messages, handlers)
+    except IntegrityError:
+        # A concurrent delivery of some of these events committed first;
+        # run again so they are seen as processed and skipped
+        db.session.rollback()
+        return _apply_events(db, processed_model, messages, handlers)
+
+
+def _apply_events(db, processed_model, messages, handlers):
+    ids = [message['id'] for message in messages]
+    seen = set(db.session.execute(
+        db.select(processed_model.event_id).where(processed_model.event_id.in_(ids))
+    ).scalars()) if ids else set()
+
+    applied = []
+    for message in messages:
+        if message['id'] in seen:
+            continue
+        seen.add(message['id'])
+        handler = handlers.get(message['topic'])
+        if handler is not None:
+            handler(message['payload'])
+        db.session.add(processed_model(event_id=message['id'], topic=message['topic']))
+        applied.append(message['id'])
+
+    db.session.commit()
+    return applied
+
+
+class HttpTransport:
+    def __init__(self, client, path='/events', headers=None):
+        self.client = client
+        self.path = path
+        self.headers = headers or {}
+
+    def publish(self, messages):
+        # Consumers dedupe by event id, so the batch POST is safe to retry
+        response = self.client.post(self.path, json={'events': messages}, headers=self.headers,
+                                    idempotent=True)
+        if response.status_code != 200:
+            raise RuntimeError(f'event delivery failed with HTTP {response.status_code}')
+
+
+class LocalEventBus:
+    def __init__(self):
+        self._handlers = {}
+
+    def subscribe(self, topic, handler):
+        self._handlers.setdefault(topic, []).append(handler)
+
+    def publish(self, messages):
+        missing = sorted({message['topic'] for message in messages} - set(self._handlers))
+        if missing:
+            raise LookupError(f"no subscribers for {', '.join(missing)}")
+        for message in messages:
+            for handler in self._handlers[message['topic']]:
+                handler(message)
+
+
+class OutboxRelay:
+    """Background thread that drains the outbox in id order."""
+
+    def __init__(self, app, db, model, transport, batch_size=100, poll_interval=1.0):
+        self.app = app
+        self.db = db
+        self.model = model
+        self.transport = transport
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.delivered = 0
+        self.failures = 0
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def start(self):
+        """Start the relay thread (again, if this process was forked)."""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='outbox-relay', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def notify(self):
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    sent = self.relay_batch()
+            except Exception:
+                logger.exception('outbox relay failed')
+                sent = 0
+            if sent < self.batch_size:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def relay_batch(self):
+        """Deliver one batch; returns the number of events delivered."""
+        Event = self.model
+        session = self.db.session
+        stmt = (self.db.select(Event).where(Event.delivered_at.is_(None))
+                .order_by(Event.id).limit(self.batch_size))
+        if self.db.engine.dialect.name == 'postgresql':
+            # Held until the batch is marked delivered; other relays skip these rows
+            stmt = stmt.with_for_update(skip_locked=True)
+        events = session.execute(stmt).scalars().all()
+        if not events:
+            return 0
+
+        try:
+            self.transport.publish([event.to_message() for event in events])
+        except Exception as e:
+            # Left undelivered; the next poll retries the same batch
+            logger.warning('outbox delivery failed: %s', e)
+            for event in events:
+                event.attempts += 1
+                event.last_error = str(e)[:500]
+            session.commit()
+            self.failures += 1
+            return 0
+
+        now = datetime.utcnow()
+        for event in events:
+            event.attempts += 1
+            event.delivered_at = now
+            event.last_error = None
+        session.commit()
+        self.delivered += len(events)
+        return len(events)
+
+    def stats(self):
+        Event = self.model
+        pending = self.db.session.execute(
+            self.db.select(self.db.func.count()).select_from(Event).where(Event.delivered_at.is_(None))
+        ).scalar()
+        return {'pending': pending, 'delivered': self.delivered, 'failures': self.failures}
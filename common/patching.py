@@ -0,0 +1,25 @@
+"""gevent monkey-patching for services served with ``WORKER_CLASS=gevent``.
+
+gunicorn preloads the app in the master, so the app, its locks and its
+SQLAlchemy engine are created long before the gevent worker would patch
+anything. A service that may run under gevent imports this module first
+in its entry point, before Flask or any other import:
+
+    import common.patching  # noqa: F401
+
+Outside ``SERVER_MODE=production`` with ``WORKER_CLASS=gevent`` it does
+nothing.
+"""
+import os
+
+if os.environ.get('SERVER_MODE') == 'production' and os.environ.get('WORKER_CLASS') == 'gevent':
+    from gevent import monkey
+
+    monkey.patch_all()
+    # Make psycopg2 cooperate with the gevent hub
+    try:
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        pass
+    else:
+        patch_psycopg()
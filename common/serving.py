@@ -0,0 +1,108 @@
+"""Entry point shared by the services: Flask dev server or gunicorn.
+
+``SERVER_MODE=development`` (the default) keeps ``app.run`` for local work
+(``FLASK_DEBUG=1`` adds the reloader and debugger). ``SERVER_MODE=production``
+serves the same app object with gunicorn:
+
+- ``WEB_CONCURRENCY``: worker processes (default ``2 * CPUs + 1``)
+- ``WORKER_CLASS``: ``gthread`` (default), ``sync`` or ``gevent``
+- ``WEB_THREADS``: threads per ``gthread`` worker (default 4)
+- ``WORKER_CONNECTIONS``: concurrent greenlets per ``gevent`` worker
+- ``WORKER_TIMEOUT`` / ``GRACEFUL_TIMEOUT``: hung-worker kill and drain time
+- ``MAX_REQUESTS``: recycle workers after this many requests (0 disables)
+
+The app is preloaded in the master and forked; with gevent workers the
+service must import ``common.patching`` first (see there). SIGTERM drains in-flight
+requests for up to ``GRACEFUL_TIMEOUT`` seconds; SIGHUP replaces workers
+gracefully (with preloading this does not pick up code changes).
+"""
+import glob
+import multiprocessing
+import os
+
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def worker_processes():
+    """Processes serving the app: gunicorn workers in production, else one."""
+    if os.environ.get('SERVER_MODE', 'development') != 'production':
+        return 1
+    return env_int('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1)
+
+
+def gunicorn_options(port):
+    worker_class = os.environ.get('WORKER_CLASS', 'gthread')
+    return {
+        'bind': f"0.0.0.0:{port}",
+        'workers': worker_processes(),
+        'worker_class': worker_class,
+        'threads': env_int('WEB_THREADS', 4) if worker_class == 'gthread' else 1,
+        'worker_connections': env_int('WORKER_CONNECTIONS', 1000),
+        'preload_app': True,
+        'timeout': env_int('WORKER_TIMEOUT', 30),
+        'graceful_timeout': env_int('GRACEFUL_TIMEOUT', 30),
+        'keepalive': env_int('KEEPALIVE', 5),
+        'max_requests': env_int('MAX_REQUESTS', 10000),
+        'max_requests_jitter': env_int('MAX_REQUESTS_JITTER', 1000),
+        'accesslog': os.environ.get('ACCESS_LOG', '-'),
+        'errorlog': '-',
+    }
+
+
+def run(app, port, db=None, on_worker_start=()):
+    """Serve ``app`` on ``port`` according to ``SERVER_MODE``.
+
+    ``on_worker_start`` callables run in every worker once it is initialized,
+    e.g. to start background threads that must not live in the master.
+    """
+    if os.environ.get('SERVER_MODE', 'development') != 'production':
+        debug = os.environ.get('FLASK_DEBUG', '0') == '1'
+        # With the reloader, only the child process serves requests
+        if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            for callback in on_worker_start:
+                callback()
+        app.run(host='0.0.0.0', port=port, debug=debug)
+        return
+
+    from gunicorn.app.base import BaseApplication
+
+    options = gunicorn_options(port)
+
+    def post_fork(server, worker):
+        if db is not None:
+            # Connections opened by the master during preload must not be shared
+            with app.app_context():
+                for engine in db.engines.values():
+                    engine.dispose(close=False)
+
+    def post_worker_init(worker):
+        # After the worker class has set itself up (the gevent hub included)
+        for callback in on_worker_start:
+            callback()
+
+    hooks = {'post_fork': post_fork, 'post_worker_init': post_worker_init}
+
+    metrics_dir = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if metrics_dir:
+        # Per-process metric files from a previous run would be summed in
+        os.makedirs(metrics_dir, exist_ok=True)
+        for path in glob.glob(os.path.join(metrics_dir, '*.db')):
+            os.remove(path)
+
+        def child_exit(server, worker):
+            from prometheus_client import multiprocess
+            multiprocess.mark_process_dead(worker.pid)
+
+        hooks['child_exit'] = child_exit
+
+    class Server(BaseApplication):
+        def load_config(self):
+            for key, value in dict(options, **hooks).items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    Server().run()
@@ -0,0 +1,223 @@
+"""Request ids and W3C trace-context propagation with lightweight spans.
+
+``init_tracing(app, db, service)`` makes every request a server span. The
+span continues the caller's trace when a ``traceparent`` header arrives, or
+starts a new one (reusing an ``X-Request-ID`` of 32 hex digits as the trace
+id, e.g. from the nginx gateway). SQL statements become child spans, and
+``ServiceClient`` opens a client span per outbound call and forwards
+``traceparent`` and ``X-Request-ID``.
+
+Finished spans go to the configured exporter:
+
+- ``TRACE_EXPORTER=memory`` (default): bounded in-process ``InMemoryCollector``
+  that tests can query with ``collector.spans(trace_id=...)``
+- ``TRACE_EXPORTER=file``: JSON lines appended to ``TRACE_FILE``
+- ``TRACE_EXPORTER=none``: spans are dropped
+"""
+import contextvars
+import json
+import os
+import re
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from flask import g, request
+from sqlalchemy import event
+
+TRACEPARENT_RE = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+HEX32_RE = re.compile(r'^[0-9a-f]{32}$')
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+def new_trace_id():
+    return secrets.token_hex(16)
+
+
+def new_span_id():
+    return secrets.token_hex(8)
+
+
+class Span:
+    __slots__ = ('name', 'kind', 'service', 'trace_id', 'span_id', 'parent_id',
+                 'request_id', 'attributes', 'status', 'start', '_started')
+
+    def __init__(self, name, kind='internal', parent=None, service=None, trace_id=None,
+                 parent_id=None, request_id=None, attributes=None):
+        self.name = name
+        self.kind = kind
+        self.service = service or (parent.service if parent else None)
+        self.trace_id = trace_id or (parent.trace_id if parent else new_trace_id())
+        self.span_id = new_span_id()
+        self.parent_id = parent_id or (parent.span_id if parent else None)
+        self.request_id = request_id or (parent.request_id if parent else self.trace_id)
+        self.attributes = dict(attributes or {})
+        self.status = 'ok'
+        self.start = time.time()
+        self._started = time.perf_counter()
+
+    def traceparent(self):
+        return f'00-{self.trace_id}-{self.span_id}-01'
+
+    def finish(self):
+        duration_ms = (time.perf_counter() - self._started) * 1000
+        exporter.export({
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'request_id': self.request_id,
+            'name': self.name,
+            'kind': self.kind,
+            'service': self.service,
+            'start': self.start,
+            'duration_ms': round(duration_ms, 3),
+            'status': self.status,
+            'attributes': self.attributes,
+        })
+
+
+class InMemoryCollector:
+    def __init__(self, maxlen=10000):
+        self._spans = deque(maxlen=maxlen)
+
+    def export(self, span):
+        self._spans.append(span)
+
+    def spans(self, trace_id=None, service=None):
+        return [span for span in list(self._spans)
+                if (trace_id is None or span['trace_id'] == trace_id)
+                and (service is None or span['service'] == service)]
+
+    def clear(self):
+        self._spans.clear()
+
+
+class FileExporter:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        line = json.dumps(span) + '\n'
+        with self._lock, open(self.path, 'a') as f:
+            f.write(line)
+
+
+class NullExporter:
+    def export(self, span):
+        pass
+
+
+def create_exporter():
+    kind = os.environ.get('TRACE_EXPORTER', 'memory')
+    if kind == 'file':
+        return FileExporter(os.environ.get('TRACE_FILE', 'traces.jsonl'))
+    if kind == 'none':
+        return NullExporter()
+    return InMemoryCollector()
+
+
+exporter = create_exporter()
+
+
+def current_span():
+    return _current_span.get()
+
+
+def outbound_headers(span):
+    return {'traceparent': span.traceparent(), 'X-Request-ID': span.request_id}
+
+
+@contextmanager
+def start_span(name, kind='internal', **attributes):
+    """Run a block as a child of the current span (or as a new trace)."""
+    span = Span(name, kind=kind, parent=_current_span.get(), attributes=attributes)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except Exception:
+        span.status = 'error'
+        raise
+    finally:
+        _current_span.reset(token)
+        span.finish()
+
+
+def instrument_engine(engine):
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        parent = _current_span.get()
+        span = None
+        if parent is not None:
+            operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'SQL'
+            span = Span(f'db {operation}', kind='client', parent=parent,
+                        attributes={'db.statement': statement[:200]})
+        conn.info.setdefault('trace_spans', []).append(span)
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        span = conn.info['trace_spans'].pop()
+        if span is not None:
+            span.finish()
+
+    @event.listens_for(engine, 'handle_error')
+    def handle_error(context):
+        spans = context.connection.info.get('trace_spans') if context.connection is not None else None
+        if spans:
+            span = spans.pop()
+            if span is not None:
+                span.status = 'error'
+                span.finish()
+
+
+def init_tracing(app, db=None, service=None):
+    service = service or app.import_name
+
+    @app.before_request
+    def start_server_span():
+        trace_id = parent_id = None
+        match = TRACEPARENT_RE.match(request.headers.get('traceparent', ''))
+        request_id = request.headers.get('X-Request-ID')
+        if match:
+            trace_id, parent_id = match.group(1), match.group(2)
+        elif request_id and HEX32_RE.match(request_id):
+            trace_id = request_id
+
+        span = Span(f'{request.method} {request.path}', kind='server', service=service,
+                    trace_id=trace_id, parent_id=parent_id, request_id=request_id,
+                    attributes={'http.method': request.method, 'http.target': request.full_path})
+        g.trace_span = span
+        g.trace_token = _current_span.set(span)
+
+    @app.after_request
+    def add_trace_headers(response):
+        span = g.get('trace_span')
+        if span is not None:
+            if request.url_rule is not None:
+                span.name = f'{request.method} {request.url_rule.rule}'
+            span.attributes['http.status_code'] = response.status_code
+            if response.status_code >= 500:
+                span.status = 'error'
+            response.headers['traceparent'] = span.traceparent()
+            response.headers['X-Request-ID'] = span.request_id
+        return response
+
+    @app.teardown_request
+    def finish_server_span(exc):
+        span = g.pop('trace_span', None)
+        token = g.pop('trace_token', None)
+        if span is None:
+            return
+        if exc is not None:
+            span.status = 'error'
+        if token is not None:
+            _current_span.reset(token)
+        span.finish()
+
+    if db is not None:
+        with app.app_context():
+            for engine in db.engines.values():
+                instrument_engine(engine)
@@ -1,56 +1,209 @@
+import common.patching  # noqa: F401 - gevent patching must precede all other imports
 from flask import Flask, request, jsonify
-from flask_sqlalchemy import SQLAlchemy
 import os
-import requests
+import base64
+import contextvars
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from datetime import datetime
 
+from common.auth import (INTERNAL_TOKEN_HEADER, create_verifier, internal_token,
+                         is_internal_request)
+from common.db import create_db
+from common.export import EXPORT_FORMATS, parse_since, stream_export
+from common.http import get_client
+from common.idempotency import IdempotencyStore, create_idempotency_model
+from common.metrics import init_metrics
+from common.outbox import apply_events, create_processed_event_model
+from common.serving import run
+from common.tracing import init_tracing
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'supersecretkey123')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('SQLALCHEMY_DATABASE_URI', 'sqlite:///orders.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['JWT_SECRET_KEY'] = os.environ.get('SECRET_KEY', 'supersecretkey123')
+app.config['TOKEN_REVOCATION_CHECK'] = os.environ.get('TOKEN_REVOCATION_CHECK', '0') == '1'
+app.config['SUMMARY_UPSTREAM_TIMEOUT'] = float(os.environ.get('SUMMARY_UPSTREAM_TIMEOUT', '2.0'))
+
+db = create_db(app)
+init_metrics(app, db)
+init_tracing(app, db, 'order-service')
+token_verifier = create_verifier(app)
+cart_service = get_client('http://cart-service:5004')
+product_service = get_client('http://product-service:5003')
+user_service = get_client('http://user-service:5002')
 
-db = SQLAlchemy(app)
+# Shared pool for concurrent upstream fetches (checkout summary)
+fanout_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('FANOUT_WORKERS', '16')),
+                                     thread_name_prefix='fanout')
 
 class Order(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, nullable=False)
     total_amount = db.Column(db.Float, nullable=False)
     status = db.Column(db.String(50), default='pending')
-    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+    # Set client-side so the stored value round-trips exactly through pagination cursors
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    items = db.relationship('OrderItem', backref='order', lazy='selectin')
+    
+    __table_args__ = (
+        db.Index('ix_order_user_id_created_at', 'user_id', 'created_at'),
+        db.Index('ix_order_created_at_id', 'created_at', 'id'),
+    )
 
 class OrderItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False, index=True)
     product_id = db.Column(db.Integer, nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
     price = db.Column(db.Float, nullable=False)
 
+class OrderSummary(db.Model):
+    """Order-history read model: one precomputed document per order.
+
+    Product names and images are snapshotted when the order is placed, and
+    status changes are appended to the document's timeline, so history is
+    served without joins or calls to other services.
+    """
+    __tablename__ = 'order_summary'
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    status = db.Column(db.String(50))
+    document = db.Column(db.JSON, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_order_summary_user_id_created_at', 'user_id', 'created_at', 'order_id'),
+    )
+
+def order_document(order, snapshots=None):
+    """Build the summary document; ``snapshots`` maps product_id to name and image."""
+    snapshots = snapshots or {}
+    items = []
+    for item in order.items:
+        snapshot = snapshots.get(item.product_id, {})
+        items.append({
+            'product_id': item.product_id,
+            'product_name': snapshot.get('product_name'),
+            'image_url': snapshot.get('image_url'),
+            'quantity': item.quantity,
+            'price': item.price,
+            'total': item.price * item.quantity
+        })
+    return {
+        'id': order.id,
+        'status': order.status,
+        'total_amount': order.total_amount,
+        'created_at': order.created_at.isoformat(),
+        'item_count': sum(item['quantity'] for item in items),
+        'items': items,
+        'timeline': [{'status': order.status, 'at': order.created_at.isoformat()}]
+    }
+
+def add_order_summary(order, snapshots=None):
+    db.session.add(OrderSummary(order_id=order.id, user_id=order.user_id, created_at=order.created_at,
+                                status=order.status, document=order_document(order, snapshots)))
+
+def append_status(order_id, status):
+    """Record a status change in the order's summary, in the current transaction."""
+    summary = db.session.execute(
+        db.select(OrderSummary).where(OrderSummary.order_id == order_id).with_for_update()
+    ).scalar_one_or_none()
+    if summary is None or summary.status == status:
+        return
+    document = dict(summary.document)
+    document['status'] = status
+    document['timeline'] = document['timeline'] + [{'status': status, 'at': datetime.utcnow().isoformat()}]
+    summary.document = document
+    summary.status = status
+
+def backfill_order_summaries(batch_size=500):
+    """Create summaries for orders placed before the read model existed (no snapshots)."""
+    while True:
+        orders = (Order.query.outerjoin(OrderSummary, OrderSummary.order_id == Order.id)
+                  .filter(OrderSummary.order_id.is_(None)).limit(batch_size).all())
+        if not orders:
+            return
+        for order in orders:
+            add_order_summary(order)
+        db.session.commit()
+
+ProcessedEvent = create_processed_event_model(db)
+
+IdempotencyKey = create_idempotency_model(db)
+
 with app.app_context():
     db.create_all()
+    backfill_order_summaries()
 
 def verify_token(token):
-    try:
-        response = requests.post('http://auth-service:5001/verify', 
-                               headers={'Authorization': f'Bearer {token}'})
-        return response.status_code == 200, response.json()
-    except:
-        return False, {}
+    return token_verifier.verify(token)
+
+def token_user_id():
+    token = request.headers.get('Authorization', '').replace('Bearer ', '')
+    is_valid, auth_data = verify_token(token)
+    return auth_data.get('user_id') if is_valid else None
+
+idempotency = IdempotencyStore(db, IdempotencyKey)
 
 def get_cart_items(token):
     try:
-        response = requests.get('http://cart-service:5004/cart',
-                              headers={'Authorization': f'Bearer {token}'})
+        response = cart_service.get('/cart', headers={'Authorization': f'Bearer {token}'})
         if response.status_code == 200:
             return response.json()
         return None
     except:
         return None
 
+def fetch_json(client, path, token, timeout):
+    """GET an upstream resource; returns (body, error)."""
+    response = client.get(path, headers={'Authorization': f'Bearer {token}'},
+                          timeout=(min(1.0, timeout), timeout))
+    if response.status_code == 200:
+        return response.json(), None
+    if response.status_code == 404:
+        return None, None
+    return None, f'HTTP {response.status_code}'
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+ORDER_EXPORT_COLUMNS = ('id', 'user_id', 'total_amount', 'status', 'created_at')
+
+def encode_cursor(summary):
+    raw = json.dumps([summary.created_at.isoformat(), summary.order_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    created_at, order_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return datetime.fromisoformat(created_at), int(order_id)
+
+def reserve_stock(items):
+    """Reserve stock for all items in one call; returns (status_code, body)."""
+    try:
+        response = product_service.post('/products/reserve', json={'items': items},
+                                        headers={INTERNAL_TOKEN_HEADER: internal_token(app)})
+        return response.status_code, response.json()
+    except:
+        return 503, {'error': 'Product service unavailable'}
+
+def release_stock(items):
+    try:
+        response = product_service.post('/products/release', json={'items': items},
+                                        headers={INTERNAL_TOKEN_HEADER: internal_token(app)})
+        return response.status_code == 200
+    except:
+        return False
+
 @app.route('/health', methods=['GET'])
 def health_check():
-    return jsonify({'status': 'healthy', 'service': 'order-service'})
+    return jsonify({'status': 'healthy', 'service': 'order-service', 'token_cache': token_verifier.stats()})
 
 @app.route('/orders', methods=['POST'])
+@idempotency.idempotent(scope=token_user_id)
 def create_order():
     try:
         token = request.headers.get('Authorization', '').replace('Bearer ', '')
@@ -66,27 +219,39 @@ def create_order():
         if not cart_data or not cart_data.get('cart_items'):
             return jsonify({'error': 'Cart is empty'}), 400
         
-        # Create order
-        order = Order(
-            user_id=user_id,
-            total_amount=cart_data['total_amount'],
-            status='pending'
-        )
-        
-        db.session.add(order)
-        db.session.flush()  # Get order ID
-        
-        # Add order items
-        for item in cart_data['cart_items']:
-            order_item = OrderItem(
-                order_id=order.id,
-                product_id=item['product_id'],
-                quantity=item['quantity'],
-                price=item['price']
-            )
-            db.session.add(order_item)
+        # Reserve stock for the whole cart in one call
+        stock_items = [{'product_id': item['product_id'], 'quantity': item['quantity']}
+                       for item in cart_data['cart_items']]
+        status_code, reservation = reserve_stock(stock_items)
+        if status_code != 200:
+            return jsonify(reservation), status_code if status_code in (409, 503) else 502
         
-        db.session.commit()
+        try:
+            # Create order
+            order = Order(
+                user_id=user_id,
+                total_amount=cart_data['total_amount'],
+                status='pending'
+            )
+            
+            db.session.add(order)
+            db.session.flush()  # Get order ID
+            
+            # Add order items
+            for item in cart_data['cart_items']:
+                order.items.append(OrderItem(
+                    product_id=item['product_id'],
+                    quantity=item['quantity'],
+                    price=item['price']
+                ))
+            
+            # Snapshot what the cart showed so history never needs product-service
+            add_order_summary(order, {item['product_id']: item for item in cart_data['cart_items']})
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            release_stock(stock_items)
+            raise
         
         return jsonify({
             'message': 'Order created successfully',
@@ -107,25 +272,153 @@ def get_orders():
             return jsonify({'error': 'Invalid token'}), 401
         
         user_id = auth_data.get('user_id')
-        orders = Order.query.filter_by(user_id=user_id).order_by(Order.created_at.desc()).all()
+        limit = min(max(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+        cursor = request.args.get('cursor')
         
-        orders_data = []
-        for order in orders:
-            order_items = OrderItem.query.filter_by(order_id=order.id).all()
-            
-            orders_data.append({
-                'id': order.id,
-                'total_amount': order.total_amount,
-                'status': order.status,
-                'created_at': order.created_at.isoformat(),
-                'items': [{
-                    'product_id': item.product_id,
-                    'quantity': item.quantity,
-                    'price': item.price
-                } for item in order_items]
-            })
-        
-        return jsonify({'orders': orders_data}), 200
+        query = OrderSummary.query.filter_by(user_id=user_id)
+        if cursor:
+            try:
+                cursor_created_at, cursor_id = decode_cursor(cursor)
+            except (ValueError, TypeError):
+                return jsonify({'error': 'Invalid cursor'}), 400
+            # Keyset pagination: continue strictly after the last (created_at, id) seen
+            query = query.filter(db.or_(
+                OrderSummary.created_at < cursor_created_at,
+                db.and_(OrderSummary.created_at == cursor_created_at, OrderSummary.order_id < cursor_id)
+            ))
+        
+        # One indexed range read of precomputed documents; fetch one extra row
+        # to know whether another page exists
+        summaries = (query.order_by(OrderSummary.created_at.desc(), OrderSummary.order_id.desc())
+                     .limit(limit + 1).all())
+        has_more = len(summaries) > limit
+        summaries = summaries[:limit]
+        
+        return jsonify({
+            'orders': [summary.document for summary in summaries],
+            'next_cursor': encode_cursor(summaries[-1]) if has_more else None
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Orders a payment event may still move to 'paid' or 'payment_failed'
+AWAITING_PAYMENT = ('pending', 'payment_failed')
+
+def set_status_from_payment(status):
+    def handler(payload):
+        # The payer must own the order as stored here; anything else is ignored
+        order = db.session.get(Order, payload.get('order_id'), with_for_update=True)
+        if order is None or str(order.user_id) != str(payload.get('user_id')):
+            app.logger.warning('ignoring %s for order %s: not found or not owned by the payer',
+                               status, payload.get('order_id'))
+            return
+        if order.status not in AWAITING_PAYMENT:
+            return
+        order.status = status
+        append_status(order.id, status)
+    return handler
+
+EVENT_HANDLERS = {
+    'payment.completed': set_status_from_payment('paid'),
+    'payment.failed': set_status_from_payment('payment_failed'),
+}
+
+def subscribe_local(bus):
+    """Consume events from a ``LocalEventBus`` in this process (``OUTBOX_TRANSPORT=local``)."""
+    def deliver(message):
+        with app.app_context():
+            try:
+                apply_events(db, ProcessedEvent, [message], EVENT_HANDLERS)
+            except Exception:
+                db.session.rollback()
+                raise
+    for topic in EVENT_HANDLERS:
+        bus.subscribe(topic, deliver)
+
+@app.route('/orders/export', methods=['GET'])
+def export_orders():
+    # Internal endpoint for reporting jobs; not exposed through the gateway
+    if not is_internal_request(app):
+        return jsonify({'error': 'Forbidden'}), 403
+    
+    try:
+        since = parse_since(request.args.get('since'))
+    except ValueError:
+        return jsonify({'error': 'since must be an ISO 8601 timestamp'}), 400
+    
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+    
+    columns = [getattr(Order, column) for column in ORDER_EXPORT_COLUMNS]
+    stmt = db.select(*columns).order_by(Order.created_at, Order.id)
+    if since is not None:
+        stmt = stmt.where(Order.created_at >= since)
+    
+    return stream_export(db, stmt, ORDER_EXPORT_COLUMNS, fmt, filename='orders')
+
+@app.route('/events', methods=['POST'])
+def receive_events():
+    # Internal endpoint fed by other services' outbox relays; redelivered events are skipped
+    if not is_internal_request(app):
+        return jsonify({'error': 'Forbidden'}), 403
+    
+    try:
+        events = (request.get_json() or {}).get('events')
+        if not isinstance(events, list):
+            return jsonify({'error': 'events must be a list'}), 400
+        
+        applied = apply_events(db, ProcessedEvent, events, EVENT_HANDLERS)
+        
+        return jsonify({'received': len(events), 'applied': len(applied)}), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/checkout/summary', methods=['GET'])
+def checkout_summary():
+    try:
+        token = request.headers.get('Authorization', '').replace('Bearer ', '')
+        is_valid, auth_data = verify_token(token)
+        
+        if not is_valid:
+            return jsonify({'error': 'Invalid token'}), 401
+        
+        user_id = auth_data.get('user_id')
+        order_limit = min(max(request.args.get('orders', 5, type=int), 1), MAX_PAGE_SIZE)
+        timeout = app.config['SUMMARY_UPSTREAM_TIMEOUT']
+        deadline = time.monotonic() + timeout
+        
+        # Profile and cart are fetched concurrently while recent orders are read locally
+        # Each task runs in a copy of the request context so trace spans nest correctly
+        futures = {
+            'profile': fanout_executor.submit(contextvars.copy_context().run,
+                                              fetch_json, user_service, '/profile', token, timeout),
+            'cart': fanout_executor.submit(contextvars.copy_context().run,
+                                           fetch_json, cart_service, '/cart', token, timeout),
+        }
+        recent_orders = (OrderSummary.query.filter_by(user_id=user_id)
+                         .order_by(OrderSummary.created_at.desc(), OrderSummary.order_id.desc())
+                         .limit(order_limit).all())
+        
+        summary = {'recent_orders': [order.document for order in recent_orders]}
+        errors = {}
+        for name, future in futures.items():
+            try:
+                summary[name], error = future.result(timeout=max(deadline - time.monotonic(), 0))
+            except FutureTimeoutError:
+                summary[name], error = None, 'timeout'
+            except Exception as e:
+                summary[name], error = None, str(e) or type(e).__name__
+            if error:
+                errors[name] = error
+        
+        summary['errors'] = errors
+        summary['partial'] = bool(errors)
+        
+        return jsonify(summary), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -149,6 +442,7 @@ def update_order_status(order_id):
             return jsonify({'error': 'Order not found'}), 404
         
         order.status = new_status
+        append_status(order.id, new_status)
         db.session.commit()
         
         return jsonify({'message': 'Order status updated successfully'}), 200
@@ -157,4 +451,4 @@ def update_order_status(order_id):
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5005, debug=True)
+    run(app, 5005, db=db)
@@ -1,15 +1,36 @@
+import common.patching  # noqa: F401 - gevent patching must precede all other imports
 from flask import Flask, request, jsonify
-from flask_sqlalchemy import SQLAlchemy
 import os
-import requests
 import uuid
+from datetime import datetime
+
+from common.auth import (INTERNAL_TOKEN_HEADER, create_verifier, internal_token,
+                         is_internal_request)
+from common.db import create_db
+from common.export import EXPORT_FORMATS, parse_since, stream_export
+from common.http import get_client
+from common.idempotency import IdempotencyStore, create_idempotency_model
+from common.metrics import init_metrics
+from common.outbox import HttpTransport, LocalEventBus, OutboxRelay, add_event, create_outbox_model
+from common.serving import run
+from common.tracing import init_tracing
+from worker import JobWorkerPool
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'supersecretkey123')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('SQLALCHEMY_DATABASE_URI', 'sqlite:///payments.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['JWT_SECRET_KEY'] = os.environ.get('SECRET_KEY', 'supersecretkey123')
+app.config['TOKEN_REVOCATION_CHECK'] = os.environ.get('TOKEN_REVOCATION_CHECK', '0') == '1'
+app.config['PAYMENT_ASYNC'] = os.environ.get('PAYMENT_ASYNC', '0') == '1'
+app.config['PAYMENT_WORKERS'] = int(os.environ.get('PAYMENT_WORKERS', '4'))
+app.config['OUTBOX_TRANSPORT'] = os.environ.get('OUTBOX_TRANSPORT', 'http')
 
-db = SQLAlchemy(app)
+db = create_db(app)
+init_metrics(app, db)
+init_tracing(app, db, 'payment-service')
+token_verifier = create_verifier(app)
+order_service = get_client('http://order-service:5005')
 
 class Payment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -20,32 +41,131 @@ class Payment(db.Model):
     transaction_id = db.Column(db.String(100), unique=True, nullable=False)
     status = db.Column(db.String(50), default='pending')
     created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+    
+    __table_args__ = (
+        db.Index('ix_payment_created_at_id', 'created_at', 'id'),
+    )
+
+PAYMENT_EXPORT_COLUMNS = ('id', 'order_id', 'user_id', 'amount', 'payment_method', 'transaction_id',
+                          'status', 'created_at')
+
+OutboxEvent = create_outbox_model(db)
+
+class PaymentJob(db.Model):
+    """Durable queue entry for a payment processed in the background."""
+    id = db.Column(db.Integer, primary_key=True)
+    payment_id = db.Column(db.Integer, db.ForeignKey('payment.id'), nullable=False)
+    status = db.Column(db.String(20), default='queued', nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    last_error = db.Column(db.String(500))
+    enqueued_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('ix_payment_job_status_id', 'status', 'id'),
+    )
+
+IdempotencyKey = create_idempotency_model(db)
 
 with app.app_context():
     db.create_all()
 
 def verify_token(token):
-    try:
-        response = requests.post('http://auth-service:5001/verify', 
-                               headers={'Authorization': f'Bearer {token}'})
-        return response.status_code == 200, response.json()
-    except:
-        return False, {}
+    return token_verifier.verify(token)
 
-def update_order_status(order_id, status, token):
-    try:
-        response = requests.put(f'http://order-service:5005/orders/{order_id}/status',
-                              json={'status': status},
-                              headers={'Authorization': f'Bearer {token}'})
-        return response.status_code == 200
-    except:
-        return False
+def token_user_id():
+    token = request.headers.get('Authorization', '').replace('Bearer ', '')
+    is_valid, auth_data = verify_token(token)
+    return auth_data.get('user_id') if is_valid else None
+
+idempotency = IdempotencyStore(db, IdempotencyKey)
+
+def record_payment_outcome(payment):
+    """Stage the event that tells order-service about a finished payment."""
+    add_event(db.session, OutboxEvent,
+              'payment.completed' if payment.status == 'completed' else 'payment.failed',
+              {
+                  'order_id': payment.order_id,
+                  'user_id': payment.user_id,
+                  'transaction_id': payment.transaction_id,
+                  'status': payment.status
+              },
+              key=payment.order_id)
+
+FINAL_PAYMENT_STATUSES = ('completed', 'failed')
+
+def charge(payment, idempotency_key):
+    # Simulate payment processing
+    # In real implementation, you would integrate with payment gateway and send
+    # idempotency_key, so a repeated charge returns the first result
+    return True  # Simulate successful payment
+
+def run_payment_job(job):
+    payment = db.session.get(Payment, job.payment_id, with_for_update=True)
+    # A retried or requeued job whose charge already went through only finishes the job
+    if payment.status not in FINAL_PAYMENT_STATUSES:
+        payment.status = 'processing'
+        db.session.commit()
+        
+        payment_successful = charge(payment, idempotency_key=payment.transaction_id)
+        payment.status = 'completed' if payment_successful else 'failed'
+        record_payment_outcome(payment)
+    
+    # Outcome and job completion in one commit
+    job.status = 'done'
+    job.last_error = None
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+    outbox_relay.notify()
+
+def give_up_payment_job(job):
+    """Out of attempts: fail the payment too, in the commit that fails the job."""
+    payment = db.session.get(Payment, job.payment_id, with_for_update=True)
+    if payment.status not in FINAL_PAYMENT_STATUSES:
+        payment.status = 'failed'
+        record_payment_outcome(payment)
+    outbox_relay.notify()
+
+# Events go to order-service over HTTP; 'local' keeps them in this process
+# (for running the services together in one process without a broker). In
+# that mode order-service's subscribe_local(event_bus) must be wired up, or
+# events stay pending.
+if app.config['OUTBOX_TRANSPORT'] == 'local':
+    event_bus = LocalEventBus()
+    outbox_relay = OutboxRelay(app, db, OutboxEvent, event_bus)
+else:
+    event_bus = None
+    outbox_relay = OutboxRelay(app, db, OutboxEvent, HttpTransport(
+        order_service, headers={INTERNAL_TOKEN_HEADER: internal_token(app)}))
+
+payment_workers = JobWorkerPool(app, db, PaymentJob, run_payment_job,
+                                size=app.config['PAYMENT_WORKERS'], on_give_up=give_up_payment_job)
+
+def wants_async():
+    if 'respond-async' in request.headers.get('Prefer', ''):
+        return True
+    return request.args.get('async', type=lambda v: v.lower() in ('1', 'true'),
+                            default=app.config['PAYMENT_ASYNC'])
+
+@app.before_request
+def start_background_workers():
+    # No-op once running in this process; restarts threads after a fork
+    payment_workers.start()
+    outbox_relay.start()
 
 @app.route('/health', methods=['GET'])
 def health_check():
-    return jsonify({'status': 'healthy', 'service': 'payment-service'})
+    return jsonify({
+        'status': 'healthy',
+        'service': 'payment-service',
+        'token_cache': token_verifier.stats(),
+        'payment_queue': payment_workers.stats(),
+        'outbox': outbox_relay.stats()
+    })
 
 @app.route('/payments', methods=['POST'])
+@idempotency.idempotent(scope=token_user_id)
 def process_payment():
     try:
         token = request.headers.get('Authorization', '').replace('Bearer ', '')
@@ -63,26 +183,46 @@ def process_payment():
         # Generate transaction ID
         transaction_id = str(uuid.uuid4())
         
-        # Simulate payment processing
-        # In real implementation, you would integrate with payment gateway
-        payment_successful = True  # Simulate successful payment
+        if wants_async():
+            # Persist the pending payment and its queue entry together, process later
+            payment = Payment(
+                order_id=order_id,
+                user_id=user_id,
+                amount=amount,
+                payment_method=payment_method,
+                transaction_id=transaction_id,
+                status='pending'
+            )
+            db.session.add(payment)
+            db.session.flush()
+            db.session.add(PaymentJob(payment_id=payment.id))
+            db.session.commit()
+            payment_workers.notify()
+            
+            return jsonify({
+                'message': 'Payment accepted for processing',
+                'transaction_id': transaction_id,
+                'status': 'pending',
+                'status_url': f'/payments/{order_id}'
+            }), 202, {'Location': f'/payments/{order_id}'}
         
         payment = Payment(
             order_id=order_id,
             user_id=user_id,
             amount=amount,
             payment_method=payment_method,
-            transaction_id=transaction_id,
-            status='completed' if payment_successful else 'failed'
+            transaction_id=transaction_id
         )
+        payment_successful = charge(payment, idempotency_key=transaction_id)
+        payment.status = 'completed' if payment_successful else 'failed'
         
+        # The order status update is delivered from the outbox after commit
         db.session.add(payment)
+        record_payment_outcome(payment)
         db.session.commit()
+        outbox_relay.notify()
         
-        # Update order status
         if payment_successful:
-            update_order_status(order_id, 'paid', token)
-            
             return jsonify({
                 'message': 'Payment processed successfully',
                 'transaction_id': transaction_id,
@@ -98,6 +238,28 @@ def process_payment():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/payments/export', methods=['GET'])
+def export_payments():
+    # Internal endpoint for reporting jobs; not exposed through the gateway
+    if not is_internal_request(app):
+        return jsonify({'error': 'Forbidden'}), 403
+    
+    try:
+        since = parse_since(request.args.get('since'))
+    except ValueError:
+        return jsonify({'error': 'since must be an ISO 8601 timestamp'}), 400
+    
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+    
+    columns = [getattr(Payment, column) for column in PAYMENT_EXPORT_COLUMNS]
+    stmt = db.select(*columns).order_by(Payment.created_at, Payment.id)
+    if since is not None:
+        stmt = stmt.where(Payment.created_at >= since)
+    
+    return stream_export(db, stmt, PAYMENT_EXPORT_COLUMNS, fmt, filename='payments')
+
 @app.route('/payments/<int:order_id>', methods=['GET'])
 def get_payment_status(order_id):
     try:
@@ -108,7 +270,8 @@ def get_payment_status(order_id):
             return jsonify({'error': 'Invalid token'}), 401
         
         user_id = auth_data.get('user_id')
-        payment = Payment.query.filter_by(order_id=order_id, user_id=user_id).first()
+        payment = (Payment.query.filter_by(order_id=order_id, user_id=user_id)
+                   .order_by(Payment.id.desc()).first())
         
         if not payment:
             return jsonify({'error': 'Payment not found'}), 404
@@ -126,4 +289,4 @@ def get_payment_status(order_id):
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5006, debug=True)
+    run(app, 5006, db=db, on_worker_start=[payment_workers.start, outbox_relay.start])
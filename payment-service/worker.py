@@ -0,0 +1,159 @@
+"""Background worker pool fed by a durable job table.
+
+Jobs are rows in a table (see ``PaymentJob`` in payment.py) so they survive
+restarts. Workers claim a job with a conditional UPDATE, which makes the
+claim safe across threads and across worker processes sharing the database.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+
+class JobWorkerPool:
+    """Run ``handler(job)`` for queued jobs on a fixed number of threads.
+
+    A job whose handler raises is re-queued until it has been attempted
+    ``max_attempts`` times, then marked ``failed``; ``on_give_up(job)`` runs
+    in that same transaction to settle whatever the job was for. Jobs left
+    ``processing`` for longer than ``stale_after`` seconds (e.g. after a
+    crash) are re-queued.
+    """
+
+    def __init__(self, app, db, job_model, handler, size=4, poll_interval=1.0,
+                 stale_after=300, max_attempts=3, on_give_up=None):
+        self.app = app
+        self.db = db
+        self.job_model = job_model
+        self.handler = handler
+        self.on_give_up = on_give_up
+        self.size = size
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.max_attempts = max_attempts
+
+        self.processed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._pid = None
+
+    def start(self):
+        """Start the worker threads (again, if this process was forked)."""
+        with self._lock:
+            if self._pid == os.getpid() or self.size <= 0:
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._threads = [
+                threading.Thread(target=self._run, name=f'job-worker-{i}', daemon=True)
+                for i in range(self.size)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def notify(self):
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    worked = self._process_one()
+            except Exception:
+                logger.exception('job worker loop failed')
+                worked = False
+            if not worked:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def _claim(self):
+        Job = self.job_model
+        session = self.db.session
+        now = datetime.utcnow()
+
+        session.execute(
+            self.db.update(Job)
+            .where(Job.status == 'processing',
+                   Job.started_at < now - timedelta(seconds=self.stale_after))
+            .values(status='queued')
+        )
+        candidates = session.execute(
+            self.db.select(Job.id).where(Job.status == 'queued').order_by(Job.id).limit(self.size)
+        ).scalars().all()
+
+        for job_id in candidates:
+            claimed = session.execute(
+                self.db.update(Job)
+                .where(Job.id == job_id, Job.status == 'queued')
+                .values(status='processing', started_at=now, attempts=Job.attempts + 1)
+            ).rowcount
+            if claimed:
+                session.commit()
+                return session.get(Job, job_id)
+        session.commit()
+        return None
+
+    def _process_one(self):
+        job = self._claim()
+        if job is None:
+            return False
+
+        started = time.monotonic()
+        try:
+            self.handler(job)
+            job.status = 'done'
+            job.last_error = None
+        except Exception as e:
+            self.db.session.rollback()
+            logger.exception('job %s failed', job.id)
+            job = self.db.session.get(self.job_model, job.id)
+            job.last_error = str(e)[:500]
+            job.status = 'failed' if job.attempts >= self.max_attempts else 'queued'
+            if job.status == 'failed' and self.on_give_up is not None:
+                self.on_give_up(job)
+        job.finished_at = datetime.utcnow()
+        self.db.session.commit()
+
+        latency = time.monotonic() - started
+        with self._lock:
+            self.processed += 1
+            self.failed += job.status == 'failed'
+            self.total_wait += (job.started_at - job.enqueued_at).total_seconds()
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+        return True
+
+    def stats(self):
+        Job = self.job_model
+        counts = dict(self.db.session.execute(
+            self.db.select(Job.status, self.db.func.count())
+            .where(Job.status.in_(['queued', 'processing']))
+            .group_by(Job.status)
+        ).all())
+        processed = self.processed or 1
+        return {
+            'workers': self.size,
+            'depth': counts.get('queued', 0),
+            'in_progress': counts.get('processing', 0),
+            'processed': self.processed,
+            'failed': self.failed,
+            'avg_wait_ms': round(self.total_wait / processed * 1000, 2),
+            'avg_latency_ms': round(self.total_latency / processed * 1000, 2),
+            'max_latency_ms': round(self.max_latency * 1000, 2),
+        }
@@ -0,0 +1,113 @@
+"""Precomputed category facets for catalog browsing.
+
+``category_facet`` keeps one row per category with its product count,
+in-stock count and price range, so ``GET /products/facets`` reads a handful
+of rows instead of aggregating ``product``. Write paths update it in the
+same transaction as the product change:
+
+- ``record_added(db, model, rows)`` after products are inserted (single
+  creates and each import batch)
+- ``record_stock_changes(db, model, changes)`` when a reserve or release
+  moves products into or out of stock
+
+Products are never deleted or repriced, so counts move by deltas and the
+price range only widens. ``rebuild`` recomputes the table from ``product``
+(``flask --app product rebuild-facets``) if it ever drifts.
+"""
+from sqlalchemy import case, func
+from sqlalchemy.dialects import postgresql, sqlite
+
+# Key for products without a category; the API reports it as null
+UNCATEGORIZED = ''
+
+
+def summarize(rows):
+    """Aggregate inserted ``rows`` (dicts) into one facet delta per category."""
+    totals = {}
+    for row in rows:
+        category = row.get('category') or UNCATEGORIZED
+        price = float(row['price'])
+        in_stock = 1 if int(row.get('stock_quantity') or 0) > 0 else 0
+        total = totals.get(category)
+        if total is None:
+            totals[category] = {'category': category, 'product_count': 1, 'in_stock_count': in_stock,
+                                'min_price': price, 'max_price': price}
+        else:
+            total['product_count'] += 1
+            total['in_stock_count'] += in_stock
+            total['min_price'] = min(total['min_price'], price)
+            total['max_price'] = max(total['max_price'], price)
+    # Category order keeps row lock order stable between concurrent writers
+    return [totals[category] for category in sorted(totals)]
+
+
+def record_added(db, model, rows):
+    deltas = summarize(rows)
+    if not deltas:
+        return
+    if db.engine.dialect.name == 'postgresql':
+        insert, least, greatest = postgresql.insert, func.least, func.greatest
+    else:
+        # SQLite's two-argument min()/max() are scalar
+        insert, least, greatest = sqlite.insert, func.min, func.max
+    stmt = insert(model).values(deltas)
+    db.session.execute(stmt.on_conflict_do_update(index_elements=['category'], set_={
+        'product_count': model.product_count + stmt.excluded.product_count,
+        'in_stock_count': model.in_stock_count + stmt.excluded.in_stock_count,
+        'min_price': least(model.min_price, stmt.excluded.min_price),
+        'max_price': greatest(model.max_price, stmt.excluded.max_price),
+        'updated_at': func.current_timestamp(),
+    }))
+
+
+def record_stock_changes(db, model, changes):
+    """Apply ``(category, old_stock, new_stock)`` changes to the in-stock counts.
+
+    Only changes that cross zero touch the facet rows, so most reservations
+    leave them alone.
+    """
+    deltas = {}
+    for category, old_stock, new_stock in changes:
+        delta = (new_stock > 0) - (old_stock > 0)
+        if delta:
+            category = category or UNCATEGORIZED
+            deltas[category] = deltas.get(category, 0) + delta
+    for category in sorted(deltas):
+        if deltas[category]:
+            db.session.execute(
+                db.update(model)
+                .where(model.category == category)
+                .values(in_stock_count=model.in_stock_count + deltas[category],
+                        updated_at=func.current_timestamp())
+            )
+
+
+def rebuild(db, model, product_model):
+    """Recompute every facet from ``product``; returns the number of categories."""
+    category = func.coalesce(product_model.category, UNCATEGORIZED)
+    select = db.select(
+        category,
+        func.count(),
+        func.sum(case((product_model.stock_quantity > 0, 1), else_=0)),
+        func.min(product_model.price),
+        func.max(product_model.price),
+    ).group_by(category)
+    try:
+        db.session.execute(db.delete(model))
+        db.session.execute(db.insert(model).from_select(
+            ['category', 'product_count', 'in_stock_count', 'min_price', 'max_price'], select))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return db.session.query(model).count()
+
+
+def facet_to_dict(facet):
+    return {
+        'category': facet.category or None,
+        'product_count': facet.product_count,
+        'in_stock_count': facet.in_stock_count,
+        'min_price': facet.min_price,
+        'max_price': facet.max_price,
+    }
@@ -0,0 +1,186 @@
+"""Bulk product import from streamed NDJSON or CSV.
+
+Rows are parsed and validated one at a time as the upload is read, and
+valid rows are inserted ``batch_size`` at a time: with ``COPY`` on
+PostgreSQL and an executemany ``INSERT`` elsewhere. Invalid rows are
+reported by line number and skipped. If the database rejects a batch, its
+rows are retried one by one so only the offending rows are reported.
+``after_insert(rows)`` runs in each insert's transaction, before commit.
+"""
+import csv
+import io
+import json
+import logging
+import math
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+IMPORT_COLUMNS = ('name', 'description', 'price', 'stock_quantity', 'category', 'image_url')
+MAX_REPORTED_ERRORS = 1000
+
+# Column lengths from the Product model
+MAX_LENGTHS = {'name': 200, 'category': 100, 'image_url': 500}
+
+
+class RowError(ValueError):
+    pass
+
+
+def read_ndjson(stream):
+    """Yield ``(line_number, record)``; a record that is not an object is a RowError."""
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_number, RowError(f'invalid JSON: {e}')
+            continue
+        yield line_number, record if isinstance(record, dict) else RowError('row must be a JSON object')
+
+
+def read_csv(stream):
+    reader = csv.DictReader(stream)
+    for record in reader:
+        # Line where the record ended, so multi-line quoted fields still point at the row
+        yield reader.line_num, record
+
+
+def _number(value, field, cast):
+    if isinstance(value, bool):
+        raise RowError(f'{field} must be a number')
+    try:
+        number = cast(value)
+    except (TypeError, ValueError):
+        raise RowError(f'{field} must be a number') from None
+    if cast is int and isinstance(value, float) and value != number:
+        raise RowError(f'{field} must be an integer')
+    if not math.isfinite(number) or number < 0:
+        raise RowError(f'{field} must be a non-negative number')
+    return number
+
+
+def validate_row(record):
+    """Return the insert values for one record or raise RowError."""
+    if isinstance(record, RowError):
+        raise record
+
+    row = {}
+    for column in IMPORT_COLUMNS:
+        value = record.get(column)
+        # CSV has no null; treat empty cells as missing
+        row[column] = None if value == '' else value
+
+    name = row['name']
+    if not isinstance(name, str) or not name.strip():
+        raise RowError('name is required')
+    row['name'] = name.strip()
+    if row['price'] is None:
+        raise RowError('price is required')
+    row['price'] = _number(row['price'], 'price', float)
+    row['stock_quantity'] = 0 if row['stock_quantity'] is None else _number(
+        row['stock_quantity'], 'stock_quantity', int)
+
+    for column in ('description', 'category', 'image_url'):
+        if row[column] is not None and not isinstance(row[column], str):
+            raise RowError(f'{column} must be a string')
+    for column, limit in MAX_LENGTHS.items():
+        if row[column] is not None and len(row[column]) > limit:
+            raise RowError(f'{column} is longer than {limit} characters')
+    return row
+
+
+class ProductImporter:
+    def __init__(self, db, model, batch_size=1000, after_insert=None):
+        self.db = db
+        self.model = model
+        self.batch_size = batch_size
+        self.after_insert = after_insert
+        self.use_copy = db.engine.dialect.name == 'postgresql'
+
+        self.rows = 0
+        self.inserted = 0
+        self.rejected = 0
+        self.batches = 0
+        self.errors = []
+
+    def reject(self, line_number, message):
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line_number, 'error': message})
+
+    def run(self, records):
+        """Validate and insert ``(line_number, record)`` pairs; returns the report."""
+        start = time.perf_counter()
+        batch = []
+        for line_number, record in records:
+            self.rows += 1
+            try:
+                batch.append((line_number, validate_row(record)))
+            except RowError as e:
+                self.reject(line_number, str(e))
+                continue
+            if len(batch) >= self.batch_size:
+                self.flush(batch)
+                batch = []
+        if batch:
+            self.flush(batch)
+
+        elapsed = time.perf_counter() - start
+        return {
+            'rows': self.rows,
+            'inserted': self.inserted,
+            'rejected': self.rejected,
+            'batches': self.batches,
+            'errors': self.errors,
+            'errors_truncated': self.rejected > len(self.errors),
+            'elapsed_ms': round(elapsed * 1000, 1),
+            'rows_per_second': round(self.rows / elapsed) if elapsed else None,
+        }
+
+    def flush(self, batch):
+        rows = [row for _, row in batch]
+        try:
+            if self.use_copy:
+                self.copy_rows(rows)
+            else:
+                self.db.session.execute(self.model.__table__.insert(), rows)
+            if self.after_insert:
+                self.after_insert(rows)
+            self.db.session.commit()
+            self.inserted += len(rows)
+        except Exception as e:
+            self.db.session.rollback()
+            logger.warning('import batch failed, retrying row by row: %s', e)
+            for line_number, row in batch:
+                try:
+                    self.db.session.execute(self.model.__table__.insert(), [row])
+                    if self.after_insert:
+                        self.after_insert([row])
+                    self.db.session.commit()
+                    self.inserted += 1
+                except Exception as row_error:
+                    self.db.session.rollback()
+                    self.reject(line_number, str(getattr(row_error, 'orig', row_error)))
+        self.batches += 1
+
+    def copy_rows(self, rows):
+        """COPY the batch through the session's psycopg2 connection."""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        # created_at's default is applied by SQLAlchemy, which COPY bypasses
+        now = datetime.utcnow().isoformat()
+        for row in rows:
+            writer.writerow([row[column] for column in IMPORT_COLUMNS] + [now])
+        buffer.seek(0)
+
+        columns = ', '.join(IMPORT_COLUMNS + ('created_at',))
+        # Unquoted empty fields load as NULL in CSV mode
+        sql = f'COPY {self.model.__tablename__} ({columns}) FROM STDIN WITH (FORMAT csv)'
+        cursor = self.db.session.connection().connection.cursor()
+        try:
+            cursor.copy_expert(sql, buffer)
+        finally:
+            cursor.close()
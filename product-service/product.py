@@ -1,13 +1,34 @@
 from flask import Flask, request, jsonify
-from flask_sqlalchemy import SQLAlchemy
+import click
+import io
 import os
 
+from common.auth import is_internal_request
+from common.cache import TTLCache
+from common.db import create_db
+from common.export import EXPORT_FORMATS, parse_since, stream_export
+from common.metrics import init_metrics
+from common.serving import run
+from common.tracing import init_tracing
+from facets import facet_to_dict, rebuild, record_added, record_stock_changes
+from importer import ProductImporter, read_csv, read_ndjson
+from search import init_search_index, search_product_ids
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'supersecretkey123')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('SQLALCHEMY_DATABASE_URI', 'sqlite:///products.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['PRODUCT_CACHE_TTL'] = float(os.environ.get('PRODUCT_CACHE_TTL', '30'))
+app.config['PRODUCT_CACHE_SIZE'] = int(os.environ.get('PRODUCT_CACHE_SIZE', '2048'))
+app.config['IMPORT_BATCH_SIZE'] = int(os.environ.get('IMPORT_BATCH_SIZE', '1000'))
+
+db = create_db(app)
+init_metrics(app, db)
+init_tracing(app, db, 'product-service')
 
-db = SQLAlchemy(app)
+# Read-through caches for catalog reads; per worker process, bounded by TTL
+product_cache = TTLCache(maxsize=app.config['PRODUCT_CACHE_SIZE'], ttl=app.config['PRODUCT_CACHE_TTL'])
+listing_cache = TTLCache(maxsize=app.config['PRODUCT_CACHE_SIZE'], ttl=app.config['PRODUCT_CACHE_TTL'])
 
 class Product(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -18,9 +39,24 @@ class Product(db.Model):
     category = db.Column(db.String(100))
     image_url = db.Column(db.String(500))
     created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+    
+    __table_args__ = (
+        db.Index('ix_product_category_id', 'category', 'id'),
+        db.Index('ix_product_created_at_id', 'created_at', 'id'),
+    )
+
+class CategoryFacet(db.Model):
+    # Per-category aggregates for GET /products/facets, maintained by facets.py
+    category = db.Column(db.String(100), primary_key=True)
+    product_count = db.Column(db.Integer, nullable=False, default=0)
+    in_stock_count = db.Column(db.Integer, nullable=False, default=0)
+    min_price = db.Column(db.Float)
+    max_price = db.Column(db.Float)
+    updated_at = db.Column(db.DateTime, default=db.func.current_timestamp())
 
 with app.app_context():
     db.create_all()
+    init_search_index(db)
     # Add sample products if none exist
     if Product.query.count() == 0:
         sample_products = [
@@ -32,10 +68,90 @@ with app.app_context():
         for product in sample_products:
             db.session.add(product)
         db.session.commit()
+    # First start with this table, or after it was dropped: compute it once
+    if CategoryFacet.query.first() is None and Product.query.first() is not None:
+        rebuild(db, CategoryFacet, Product)
+
+MAX_BATCH_SIZE = 500
+PRODUCT_EXPORT_COLUMNS = ('id', 'name', 'description', 'price', 'stock_quantity', 'category',
+                          'image_url', 'created_at')
+MAX_PAGE_SIZE = 100
+COUNT_MODES = ('exact', 'estimate', 'none')
+
+def product_to_dict(product):
+    return {
+        'id': product.id,
+        'name': product.name,
+        'description': product.description,
+        'price': product.price,
+        'stock_quantity': product.stock_quantity,
+        'category': product.category,
+        'image_url': product.image_url
+    }
+
+def invalidate_catalog_cache(product_ids=()):
+    for product_id in product_ids:
+        product_cache.pop(product_id)
+    listing_cache.clear()
 
 @app.route('/health', methods=['GET'])
 def health_check():
-    return jsonify({'status': 'healthy', 'service': 'product-service'})
+    return jsonify({
+        'status': 'healthy',
+        'service': 'product-service',
+        'cache': {'products': product_cache.stats(), 'listings': listing_cache.stats()}
+    })
+
+def estimate_product_count():
+    # Planner statistics are only cheap and meaningful on Postgres
+    if db.engine.dialect.name != 'postgresql':
+        return None
+    estimate = db.session.execute(
+        db.text('SELECT reltuples FROM pg_class WHERE relname = :table'),
+        {'table': Product.__tablename__}
+    ).scalar()
+    return int(estimate) if estimate is not None and estimate >= 0 else None
+
+def load_offset_page(page, per_page, category, count_mode):
+    query = Product.query
+    if category:
+        query = query.filter_by(category=category)
+    
+    if count_mode == 'exact':
+        products = query.paginate(page=page, per_page=per_page, max_per_page=MAX_PAGE_SIZE, error_out=False)
+        return {
+            'products': [product_to_dict(p) for p in products.items],
+            'total': products.total,
+            'pages': products.pages,
+            'current_page': page
+        }
+    
+    # Count-free: read one extra row to report whether a next page exists
+    per_page = min(max(per_page, 1), MAX_PAGE_SIZE)
+    items = query.order_by(Product.id).offset((max(page, 1) - 1) * per_page).limit(per_page + 1).all()
+    total = estimate_product_count() if count_mode == 'estimate' and not category else None
+    return {
+        'products': [product_to_dict(p) for p in items[:per_page]],
+        'total': total,
+        'pages': -(-total // per_page) if total is not None else None,
+        'total_is_estimate': total is not None,
+        'has_next': len(items) > per_page,
+        'current_page': page
+    }
+
+def load_keyset_page(after_id, limit, category):
+    query = Product.query.filter(Product.id > after_id)
+    if category:
+        query = query.filter_by(category=category)
+    
+    # Range scan on the primary key (or the (category, id) index when filtered)
+    items = query.order_by(Product.id).limit(limit + 1).all()
+    has_next = len(items) > limit
+    items = items[:limit]
+    return {
+        'products': [product_to_dict(p) for p in items],
+        'next_after_id': items[-1].id if has_next else None
+    }
 
 @app.route('/products', methods=['GET'])
 def get_products():
@@ -43,27 +159,38 @@ def get_products():
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 10, type=int)
         category = request.args.get('category')
+        after_id = request.args.get('after_id', type=int)
+        count_mode = request.args.get('count', 'exact')
         
-        query = Product.query
-        if category:
-            query = query.filter_by(category=category)
+        if count_mode not in COUNT_MODES:
+            return jsonify({'error': f"count must be one of {', '.join(COUNT_MODES)}"}), 400
         
-        products = query.paginate(page=page, per_page=per_page, error_out=False)
+        if after_id is not None:
+            limit = min(max(request.args.get('limit', per_page, type=int), 1), MAX_PAGE_SIZE)
+            result = listing_cache.get_or_load(
+                ('after', after_id, limit, category),
+                lambda: load_keyset_page(after_id, limit, category))
+        else:
+            result = listing_cache.get_or_load(
+                ('page', page, per_page, category, count_mode),
+                lambda: load_offset_page(page, per_page, category, count_mode))
         
-        return jsonify({
-            'products': [{
-                'id': p.id,
-                'name': p.name,
-                'description': p.description,
-                'price': p.price,
-                'stock_quantity': p.stock_quantity,
-                'category': p.category,
-                'image_url': p.image_url
-            } for p in products.items],
-            'total': products.total,
-            'pages': products.pages,
-            'current_page': page
-        }), 200
+        return jsonify(result), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/products/facets', methods=['GET'])
+def get_facets():
+    try:
+        def load_facets():
+            facets = CategoryFacet.query.order_by(CategoryFacet.category).all()
+            return {
+                'facets': [facet_to_dict(f) for f in facets],
+                'total_products': sum(f.product_count for f in facets)
+            }
+        
+        return jsonify(listing_cache.get_or_load(('facets',), load_facets)), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -71,16 +198,86 @@ def get_products():
 @app.route('/products/<int:product_id>', methods=['GET'])
 def get_product(product_id):
     try:
-        product = Product.query.get_or_404(product_id)
+        product = product_cache.get_or_load(
+            product_id, lambda: product_to_dict(Product.query.get_or_404(product_id)))
+        
+        return jsonify(product), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/products/search', methods=['GET'])
+def search_products():
+    try:
+        q = request.args.get('q', '').strip()
+        limit = min(max(request.args.get('limit', 20, type=int), 1), MAX_PAGE_SIZE)
+        offset = max(request.args.get('offset', 0, type=int), 0)
+        
+        if not q:
+            return jsonify({'error': 'q is required'}), 400
+        
+        def load_results():
+            ids = search_product_ids(db, q, limit, offset)
+            products = {p.id: p for p in Product.query.filter(Product.id.in_(ids)).all()} if ids else {}
+            return {
+                'query': q,
+                'products': [product_to_dict(products[i]) for i in ids if i in products],
+                'limit': limit,
+                'offset': offset
+            }
+        
+        return jsonify(listing_cache.get_or_load(('search', q, limit, offset), load_results)), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/products/export', methods=['GET'])
+def export_products():
+    # Internal endpoint for reporting jobs; not exposed through the gateway
+    if not is_internal_request(app):
+        return jsonify({'error': 'Forbidden'}), 403
+    
+    try:
+        since = parse_since(request.args.get('since'))
+    except ValueError:
+        return jsonify({'error': 'since must be an ISO 8601 timestamp'}), 400
+    
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+    
+    columns = [getattr(Product, column) for column in PRODUCT_EXPORT_COLUMNS]
+    stmt = db.select(*columns).order_by(Product.created_at, Product.id)
+    if since is not None:
+        stmt = stmt.where(Product.created_at >= since)
+    
+    return stream_export(db, stmt, PRODUCT_EXPORT_COLUMNS, fmt, filename='products')
+
+@app.route('/products/batch', methods=['GET', 'POST'])
+def get_products_batch():
+    try:
+        if request.method == 'POST':
+            raw_ids = (request.get_json() or {}).get('ids', [])
+            if not isinstance(raw_ids, list):
+                return jsonify({'error': 'ids must be a list'}), 400
+        else:
+            raw_ids = request.args.get('ids', '').split(',')
+        
+        try:
+            ids = list(dict.fromkeys(int(i) for i in raw_ids if str(i).strip()))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'ids must be integers'}), 400
+        
+        if len(ids) > MAX_BATCH_SIZE:
+            return jsonify({'error': f'At most {MAX_BATCH_SIZE} ids per request'}), 400
+        
+        # Single IN query for the whole batch
+        products = Product.query.filter(Product.id.in_(ids)).all() if ids else []
+        found = {p.id: product_to_dict(p) for p in products}
         
         return jsonify({
-            'id': product.id,
-            'name': product.name,
-            'description': product.description,
-            'price': product.price,
-            'stock_quantity': product.stock_quantity,
-            'category': product.category,
-            'image_url': product.image_url
+            'products': {str(product_id): product for product_id, product in found.items()},
+            'missing': [product_id for product_id in ids if product_id not in found]
         }), 200
         
     except Exception as e:
@@ -101,12 +298,172 @@ def create_product():
         )
         
         db.session.add(product)
+        db.session.flush()
+        record_added(db, CategoryFacet, [{
+            'category': product.category,
+            'price': product.price,
+            'stock_quantity': product.stock_quantity
+        }])
         db.session.commit()
+        invalidate_catalog_cache([product.id])
         
         return jsonify({'message': 'Product created successfully', 'product_id': product.id}), 201
         
     except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+IMPORT_FORMATS = {'text/csv': 'csv', 'application/x-ndjson': 'ndjson', 'application/jsonl': 'ndjson'}
+MAX_IMPORT_BATCH_SIZE = 10000
+
+@app.route('/products/import', methods=['POST'])
+def import_products():
+    # Internal endpoint for catalog loads; not exposed through the gateway
+    if not is_internal_request(app):
+        return jsonify({'error': 'Forbidden'}), 403
+    
+    try:
+        fmt = request.args.get('format') or IMPORT_FORMATS.get(request.mimetype)
+        if fmt not in ('csv', 'ndjson'):
+            return jsonify({'error': 'Send text/csv or application/x-ndjson, or set format=csv|ndjson'}), 415
+        
+        batch_size = request.args.get('batch_size', app.config['IMPORT_BATCH_SIZE'], type=int)
+        batch_size = min(max(batch_size, 1), MAX_IMPORT_BATCH_SIZE)
+        
+        # Parse the body as it arrives instead of buffering the whole upload
+        stream = io.TextIOWrapper(io.BufferedReader(request.stream), encoding='utf-8-sig', newline='')
+        records = read_csv(stream) if fmt == 'csv' else read_ndjson(stream)
+        
+        importer = ProductImporter(db, Product, batch_size=batch_size,
+                                   after_insert=lambda rows: record_added(db, CategoryFacet, rows))
+        try:
+            report = importer.run(records)
+        finally:
+            # Once for the whole import, including the batches committed before a failure
+            if importer.inserted:
+                invalidate_catalog_cache()
+        
+        return jsonify(report), 200
+        
+    except UnicodeDecodeError:
+        db.session.rollback()
+        return jsonify({'error': 'Upload must be UTF-8', 'inserted': importer.inserted}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+def parse_stock_items(data):
+    """Merge [{product_id, quantity}] into {product_id: quantity}; None if invalid."""
+    items = (data or {}).get('items')
+    if not isinstance(items, list) or not items or len(items) > MAX_BATCH_SIZE:
+        return None
+    
+    quantities = {}
+    for item in items:
+        product_id = item.get('product_id') if isinstance(item, dict) else None
+        quantity = item.get('quantity') if isinstance(item, dict) else None
+        if not isinstance(product_id, int) or not isinstance(quantity, int) or quantity <= 0:
+            return None
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return quantities
+
+def load_stock(quantities):
+    # Stock after this transaction's updates, which still hold the row locks
+    return db.session.query(Product.id, Product.category, Product.stock_quantity).filter(
+        Product.id.in_(list(quantities))).all()
+
+@app.route('/products/reserve', methods=['POST'])
+def reserve_stock():
+    # Internal endpoint for order-service; not exposed through the gateway
+    if not is_internal_request(app):
+        return jsonify({'error': 'Forbidden'}), 403
+    
+    try:
+        quantities = parse_stock_items(request.get_json())
+        if quantities is None:
+            return jsonify({'error': 'items must be a list of {product_id, quantity} with positive quantities'}), 400
+        
+        # Conditional decrements in one transaction; id order keeps lock order stable
+        unavailable = []
+        for product_id in sorted(quantities):
+            result = db.session.execute(
+                db.update(Product)
+                .where(Product.id == product_id, Product.stock_quantity >= quantities[product_id])
+                .values(stock_quantity=Product.stock_quantity - quantities[product_id])
+            )
+            if result.rowcount == 0:
+                unavailable.append(product_id)
+        
+        if unavailable:
+            db.session.rollback()
+            available = dict(db.session.query(Product.id, Product.stock_quantity)
+                             .filter(Product.id.in_(unavailable)).all())
+            return jsonify({
+                'error': 'Insufficient stock',
+                'unavailable': [{
+                    'product_id': product_id,
+                    'requested': quantities[product_id],
+                    'available': available.get(product_id)
+                } for product_id in unavailable]
+            }), 409
+        
+        record_stock_changes(db, CategoryFacet, [
+            (category, stock + quantities[product_id], stock)
+            for product_id, category, stock in load_stock(quantities)
+        ])
+        db.session.commit()
+        invalidate_catalog_cache(quantities)
+        
+        return jsonify({
+            'message': 'Stock reserved',
+            'items': [{'product_id': product_id, 'quantity': quantity}
+                      for product_id, quantity in quantities.items()]
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@app.route('/products/release', methods=['POST'])
+def release_stock():
+    # Internal endpoint for order-service; not exposed through the gateway
+    if not is_internal_request(app):
+        return jsonify({'error': 'Forbidden'}), 403
+    
+    try:
+        quantities = parse_stock_items(request.get_json())
+        if quantities is None:
+            return jsonify({'error': 'items must be a list of {product_id, quantity} with positive quantities'}), 400
+        
+        unknown = []
+        for product_id in sorted(quantities):
+            result = db.session.execute(
+                db.update(Product)
+                .where(Product.id == product_id)
+                .values(stock_quantity=Product.stock_quantity + quantities[product_id])
+            )
+            if result.rowcount == 0:
+                unknown.append(product_id)
+        
+        record_stock_changes(db, CategoryFacet, [
+            (category, stock - quantities[product_id], stock)
+            for product_id, category, stock in load_stock(quantities)
+        ])
+        db.session.commit()
+        invalidate_catalog_cache(quantities)
+        
+        return jsonify({'message': 'Stock released', 'unknown': unknown}), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@app.cli.command('rebuild-facets')
+def rebuild_facets_command():
+    """Recompute category facets from the product table."""
+    categories = rebuild(db, CategoryFacet, Product)
+    invalidate_catalog_cache()
+    click.echo(f'Rebuilt facets for {categories} categories')
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5003, debug=True)
+    run(app, 5003, db=db)
@@ -0,0 +1,108 @@
+"""Full-text product search over name, description and category.
+
+The index lives in the database and is kept up to date by the database
+itself as rows are written:
+
+- SQLite: an external-content FTS5 table fed by triggers on ``product``.
+- Postgres: a generated, weighted ``tsvector`` column with a GIN index.
+
+Other dialects fall back to a case-insensitive ``LIKE`` scan.
+"""
+import re
+
+from sqlalchemy import text
+
+SQLITE_SETUP = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING fts5(
+        name, description, category,
+        content='product', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS product_fts_ai AFTER INSERT ON product BEGIN
+        INSERT INTO product_fts(rowid, name, description, category)
+        VALUES (new.id, new.name, new.description, new.category);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS product_fts_ad AFTER DELETE ON product BEGIN
+        INSERT INTO product_fts(product_fts, rowid, name, description, category)
+        VALUES ('delete', old.id, old.name, old.description, old.category);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS product_fts_au AFTER UPDATE OF name, description, category ON product BEGIN
+        INSERT INTO product_fts(product_fts, rowid, name, description, category)
+        VALUES ('delete', old.id, old.name, old.description, old.category);
+        INSERT INTO product_fts(rowid, name, description, category)
+        VALUES (new.id, new.name, new.description, new.category);
+    END""",
+]
+
+POSTGRES_SETUP = [
+    """ALTER TABLE product ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(category, '')), 'B') ||
+            setweight(to_tsvector('english', coalesce(description, '')), 'C')
+        ) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_product_search_vector ON product USING GIN (search_vector)",
+]
+
+# bm25() column weights: name, description, category
+SQLITE_QUERY = """
+    SELECT rowid AS id FROM product_fts
+    WHERE product_fts MATCH :match
+    ORDER BY bm25(product_fts, 10.0, 1.0, 4.0)
+    LIMIT :limit OFFSET :offset
+"""
+
+POSTGRES_QUERY = """
+    SELECT id FROM product, websearch_to_tsquery('english', :q) AS query
+    WHERE search_vector @@ query
+    ORDER BY ts_rank(search_vector, query) DESC, id
+    LIMIT :limit OFFSET :offset
+"""
+
+FALLBACK_QUERY = """
+    SELECT id FROM product
+    WHERE lower(name) LIKE :pattern OR lower(description) LIKE :pattern OR lower(category) LIKE :pattern
+    ORDER BY id
+    LIMIT :limit OFFSET :offset
+"""
+
+
+def init_search_index(db):
+    """Create the search index for the current dialect if it does not exist."""
+    dialect = db.engine.dialect.name
+    with db.engine.begin() as conn:
+        if dialect == 'sqlite':
+            exists = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'product_fts'"
+            )).first()
+            for statement in SQLITE_SETUP:
+                conn.execute(text(statement))
+            if not exists:
+                # Index rows that were written before the FTS table existed
+                conn.execute(text("INSERT INTO product_fts(product_fts) VALUES ('rebuild')"))
+        elif dialect == 'postgresql':
+            for statement in POSTGRES_SETUP:
+                conn.execute(text(statement))
+
+
+def fts5_match_expression(q):
+    # Quote every term so user input cannot inject FTS5 syntax; prefix-match each
+    terms = re.findall(r'\w+', q)
+    return ' '.join('"{}"*'.format(term) for term in terms)
+
+
+def search_product_ids(db, q, limit, offset=0):
+    """Return ids of products matching ``q``, best match first."""
+    dialect = db.engine.dialect.name
+    params = {'limit': limit, 'offset': offset}
+
+    if dialect == 'sqlite':
+        match = fts5_match_expression(q)
+        if not match:
+            return []
+        rows = db.session.execute(text(SQLITE_QUERY), dict(params, match=match))
+    elif dialect == 'postgresql':
+        rows = db.session.execute(text(POSTGRES_QUERY), dict(params, q=q))
+    else:
+        rows = db.session.execute(text(FALLBACK_QUERY), dict(params, pattern=f'%{q.lower()}%'))
+
+    return [row.id for row in rows]
@@ -0,0 +1,33 @@
+"""Each service module imports cleanly in a fresh interpreter."""
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVICES = [
+    ('auth-service', 'app'),
+    ('user-service', 'user'),
+    ('product-service', 'product'),
+    ('cart-service', 'cart'),
+    ('order-service', 'order'),
+    ('payment-service', 'payment'),
+]
+
+
+@pytest.mark.parametrize('directory, module', SERVICES)
+def test_import_with_missing_multiproc_dir(tmp_path, directory, module):
+    metrics_dir = tmp_path / 'prometheus'
+    env = dict(
+        os.environ,
+        PYTHONPATH=ROOT,
+        PROMETHEUS_MULTIPROC_DIR=str(metrics_dir),
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'service.db'}",
+        TRACE_EXPORTER='none',
+    )
+    result = subprocess.run([sys.executable, '-c', f'import {module}'], cwd=os.path.join(ROOT, directory),
+                            env=env, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert metrics_dir.is_dir()
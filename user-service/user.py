@@ -1,14 +1,23 @@
 from flask import Flask, request, jsonify
-from flask_sqlalchemy import SQLAlchemy
 import os
-import requests
+
+from common.auth import create_verifier
+from common.db import create_db
+from common.metrics import init_metrics
+from common.serving import run
+from common.tracing import init_tracing
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'supersecretkey123')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('SQLALCHEMY_DATABASE_URI', 'sqlite:///users.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['JWT_SECRET_KEY'] = os.environ.get('SECRET_KEY', 'supersecretkey123')
+app.config['TOKEN_REVOCATION_CHECK'] = os.environ.get('TOKEN_REVOCATION_CHECK', '0') == '1'
 
-db = SQLAlchemy(app)
+db = create_db(app)
+init_metrics(app, db)
+init_tracing(app, db, 'user-service')
+token_verifier = create_verifier(app)
 
 class UserProfile(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -25,16 +34,11 @@ with app.app_context():
     db.create_all()
 
 def verify_token(token):
-    try:
-        response = requests.post('http://auth-service:5001/verify', 
-                               headers={'Authorization': f'Bearer {token}'})
-        return response.status_code == 200, response.json()
-    except:
-        return False, {}
+    return token_verifier.verify(token)
 
 @app.route('/health', methods=['GET'])
 def health_check():
-    return jsonify({'status': 'healthy', 'service': 'user-service'})
+    return jsonify({'status': 'healthy', 'service': 'user-service', 'token_cache': token_verifier.stats()})
 
 @app.route('/profile', methods=['POST'])
 def create_profile():
@@ -98,4 +102,4 @@ def get_profile():
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5002, debug=True)
+    run(app, 5002, db=db)